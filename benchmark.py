@@ -0,0 +1,248 @@
+# CMPT 317: Benchmarks for the block tiling model and the local search algorithms
+
+# Measures the State operations (legal_move, place_block, copying, get_score),
+# Problem.neighbors, and each search algorithm in solver.py, on grids from the
+# size of tiles1.txt up to generated 50x50 and 100x100 instances.  Everything
+# is seeded, so two runs on the same machine do the same work.
+#
+# For each operation it reports calls per second and the peak memory one
+# call allocates (from tracemalloc); for each algorithm, the time taken and
+# the score of the solution.
+#
+# Usage:
+#   python benchmark.py                         run everything
+#   python benchmark.py --sizes 5 12            only some grid sizes
+#   python benchmark.py --save baseline.json    save the results
+#   python benchmark.py --compare baseline.json compare with saved results;
+#                                               exits with status 1 if
+#                                               anything got worse
+
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+import blockTiling as P
+import localsearch as search
+import solver
+
+
+SIZES = [5, 7, 12, 50, 100]
+
+# the instance files that come with the project, by grid size
+FILES = {5: 'tiles1.txt', 7: 'tiles2.txt', 12: 'tiles3.txt'}
+
+
+def make_problem(N):
+    """ Return the problem for an N x N grid: one of the instance files if
+        there is one that size, otherwise a generated instance with an
+        equal share of the grid's area for each kind of block.
+        :param N: the grid size
+        :return: a Problem
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), FILES.get(N, ''))
+    if N in FILES and os.path.exists(path):
+        return solver.read_problem(path)
+
+    theProblem = P.Problem(N, {})
+    share = N * N // len(theProblem.library)
+    for b, shape in theProblem.library.items():
+        cells = sum(row.count('*') for row in shape)
+        theProblem.blocks[b] = max(1, share // cells)
+    return theProblem
+
+
+@contextlib.contextmanager
+def quiet():
+    """ Throw away anything printed inside the block.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def ops_per_sec(fn, min_time):
+    """ Call fn repeatedly for at least min_time seconds.
+        :param fn: a function of no arguments that returns the number of
+                   operations it did
+        :return: operations per second
+    """
+    ops = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        ops += fn()
+        elapsed = time.perf_counter() - start
+    return ops / elapsed
+
+
+def peak_kib(fn):
+    """ Return the peak memory, in KiB, allocated during one call of fn.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return (peak - before) / 1024
+
+
+def operation_benchmarks(theProblem, seed, min_time):
+    """ Benchmark the State and Problem operations on one random state
+        (and place_block on the initial state, where blocks always fit).
+        :return: a list of result dictionaries
+    """
+    rng = random.Random(seed)
+    theProblem.seed(seed)
+    s = theProblem.random_state()
+    N = theProblem.N
+
+    # a fixed batch of places to try, legal or not
+    tries = [(rng.choice(list(theProblem.library)), rng.randrange(N), rng.randrange(N))
+             for i in range(1000)]
+    # a random state is often full, so place blocks on an empty grid
+    start = theProblem.create_initial_state()
+    legal = sorted(start.legal_placements())
+    legal = rng.sample(legal, min(100, len(legal)))
+    if not legal:
+        raise ValueError('no block fits on the grid, so place_block can\'t be measured')
+
+    def legal_move():
+        for (b, row, col) in tries:
+            s.legal_move(b, row, col)
+        return len(tries)
+
+    def place_block():
+        # place and take back each of a few legal placements
+        for (b, row, col) in legal:
+            start.place_block(b, row, col)
+            start.remove_block(b, row, col)
+        return 2 * len(legal)
+
+    def copy():
+        s.copy()
+        return 1
+
+    def get_score():
+        for i in range(1000):
+            s.get_score()
+        return 1000
+
+    def neighbors():
+        theProblem.neighbors(s)
+        return 1
+
+    results = []
+    for fn in (legal_move, place_block, copy, get_score, neighbors):
+        results.append({'name': fn.__name__, 'size': N,
+                        'ops_per_sec': ops_per_sec(fn, min_time),
+                        'peak_kib': peak_kib(fn)})
+    return results
+
+
+def algorithm_benchmarks(theProblem, seed, steps, deadline):
+    """ Run each algorithm in solver.py once.
+        :param steps: the step budget for each algorithm
+        :param deadline: seconds allowed for each algorithm
+        :return: a list of result dictionaries
+    """
+    results = []
+    for algorithm in solver.ALGORITHMS:
+        budget = search.Budget(deadline)
+        tracemalloc.start()
+        start = time.perf_counter()
+        with quiet():
+            solution = solver.solve(theProblem, algorithm, steps, seed=seed, budget=budget)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({'name': algorithm, 'size': theProblem.N, 'seconds': seconds,
+                        'score': solution.get_score(), 'peak_kib': peak / 1024})
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """ Compare results with a saved baseline.
+        :param tolerance: the fraction by which a measurement may get worse
+                          before it counts as a regression
+        :return: a list of messages, one per regression
+    """
+    old = {(r['name'], r['size']): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = old.get((r['name'], r['size']))
+        if b is None:
+            continue
+        label = '%s (N=%d)' % (r['name'], r['size'])
+        if 'ops_per_sec' in r and r['ops_per_sec'] < b['ops_per_sec'] * (1 - tolerance):
+            regressions.append('%s: %.0f ops/sec, was %.0f'
+                               % (label, r['ops_per_sec'], b['ops_per_sec']))
+        # ignore slowdowns too small to time reliably
+        if ('seconds' in r and r['seconds'] > b['seconds'] * (1 + tolerance)
+                and r['seconds'] - b['seconds'] > 0.01):
+            regressions.append('%s: %.3f secs, was %.3f' % (label, r['seconds'], b['seconds']))
+        if 'score' in r and r['score'] > b['score'] * (1 + tolerance):
+            regressions.append('%s: score %d, was %d' % (label, r['score'], b['score']))
+    return regressions
+
+
+def report(results):
+    """ Print the results as a table.
+    """
+    for r in results:
+        if 'ops_per_sec' in r:
+            print('%-12s N=%-4d %14.0f ops/sec %10.1f KiB'
+                  % (r['name'], r['size'], r['ops_per_sec'], r['peak_kib']))
+        else:
+            print('%-12s N=%-4d %10.3f secs  score %-6d %10.1f KiB'
+                  % (r['name'], r['size'], r['seconds'], r['score'], r['peak_kib']))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0])
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--seed', type=int, default=317)
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='seconds to spend timing each operation')
+    parser.add_argument('--steps', type=int, default=200,
+                        help='step budget for each algorithm')
+    parser.add_argument('--deadline', type=float, default=5.0,
+                        help='seconds allowed for each algorithm')
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--compare', help='compare with results saved in this file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='how much worse a measurement may get (default 0.25)')
+    args = parser.parse_args(argv[1:])
+
+    results = []
+    for N in args.sizes:
+        theProblem = make_problem(N)
+        results += operation_benchmarks(theProblem, args.seed, args.min_time)
+        results += algorithm_benchmarks(theProblem, args.seed, args.steps, args.deadline)
+    report(results)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=1)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        print()
+        if regressions:
+            print('Regressions against', args.compare)
+            for message in regressions:
+                print('  ' + message)
+            sys.exit(1)
+        print('No regressions against', args.compare)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
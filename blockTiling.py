@@ -11,51 +11,572 @@
 
 # This implementation is provided on an as-is basis, suitable for educational purposes only.
 #
+import hashlib
+import heapq
+import json
 import random
-import random as rand
+import struct
+import weakref
 import math as M
+from array import array
+from collections import OrderedDict, deque
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# When True, State.get_score() recounts the grid and checks it against the
+# running count kept by place_block() and remove_block().  For testing only.
+CHECK_SCORE = False
+
+# The two kinds of move in the neighbourhood.  A move is a tuple
+# (op, block, row, col).
+ADD = "add"
+REMOVE = "remove"
+
+# When True, random_state() says what it is doing.
+VERBOSE = False
+
+# Problems on grids at least this big find their legal add-moves with NumPy,
+# when it is installed, unless told otherwise.
+VECTOR_MIN_N = 40
+
+# How many of the most recently used Boards are kept after nothing uses them
+# any more (see Board.get())
+BOARDS_KEPT = 4
+
+def base_name(b):
+    """ the name of the block that shape b is an orientation of; the
+    rotations and reflections of block b are named b/1, b/2, ...
+    """
+    return b.split("/")[0]
+
+
+def symmetries(rows):
+    """ return the distinct images of a grid, given as a tuple of equal
+    length strings, under the 8 rotations and reflections of the square,
+    starting with the grid itself.  Images with different dimensions from
+    the original are left out, so a grid that isn't square only has the
+    images that keep its shape.
+    """
+    images = []
+    g = tuple(rows)
+    for k in range(4):
+        for image in (g, tuple(r[::-1] for r in g)):
+            if (len(image) == len(rows) and len(image[0]) == len(rows[0])
+                    and image not in images):
+                images.append(image)
+        # rotate a quarter turn clockwise
+        g = tuple("".join(column) for column in zip(*g[::-1]))
+    return images
+
+
+def all_orientations(library):
+    """ return a copy of a block library that also has every distinct
+    rotation and reflection of each shape, named as in base_name()
+    """
+    oriented = {}
+    for b, shape in library.items():
+        for k, image in enumerate(symmetries(tuple(shape))):
+            if k == 0:
+                oriented[b] = list(image)
+            else:
+                oriented["%s/%d" % (b, k)] = list(image)
+    return oriented
+
+
+def count_index(names, library):
+    """ map each block name, and each orientation of it in library, to
+    its position in names
+    """
+    index = {b: i for i, b in enumerate(names)}
+    for b in library:
+        base = base_name(b)
+        if b not in index and base in index:
+            index[b] = index[base]
+    return index
+
+
+# The blocks, and which spaces on a grid each block would actually cover.
+LIBRARY = { "+" : [".*.",
+                   "***",
+                   ".*."],
+            "|" : ["*",
+                   "*",
+                   "*",
+                   "*"],
+            "L" : ["*..",
+                   "*..",
+                   "***"],
+            "Z" : ["**.",
+                   ".**"],
+            "T" : ["***",
+                   ".*.",
+                   ".*."],
+            "4" : ["*.", # ok it doesn't really look like a 4...
+                   "**",
+                   ".*"],
+          }
+
+# The same blocks in every orientation
+ORIENTED_LIBRARY = all_orientations(LIBRARY)
+
+
+def border_width(library):
+    """ return how wide a border a grid needs so that no shape in library
+    can hang off its right edge into the next row, or off its bottom: one
+    less than the longest side of the biggest shape
+    """
+    extent = 1
+    for shape in library.values():
+        extent = max(extent, len(shape), max(len(row) for row in shape))
+    return extent - 1
+
+
+def bit_positions(mask):
+    """ return a list of the positions of the set bits in mask, lowest first
+    """
+    positions = []
+    while mask:
+        low = mask & -mask
+        positions.append(low.bit_length() - 1)
+        mask ^= low
+    return positions
+
+
+class Board(object):
+    """Precomputed bit masks for one grid size and block library.
+
+    The grid is stored as a single integer with one bit per cell.  Rows are
+    padded with a border on the right and bottom, as wide as the library's
+    biggest shape needs (see border_width(); 3 cells for LIBRARY, exactly
+    like the original list-of-lists grid), so a shape placed anywhere on
+    the board never wraps into the next row.  The border bits are always
+    set, which makes an out-of-bounds placement look like an overlap.
+
+    The grid has N rows and width columns, and any of its cells can be
+    blocked.  Blocked cells are part of the border as far as the masks are
+    concerned: set from the start and never cleared, so a placement over one
+    is never numbered, and a rectangular or holed board costs nothing more
+    to search than a square one.
+
+    Every placement that fits on the board is numbered once, up front, and
+    each cell knows which placements cover it.  A State uses that table to
+    keep its set of legal placements up to date as blocks come and go.
+
+    Boards are shared by every State of the same problem; use Board.get()
+    rather than building them directly.
+    """
+
+    # every Board still in use by some State, and the few used last, so
+    # that a sweep over instances of one size builds its Board once but
+    # a sweep over many sizes or masks doesn't keep them all
+    _cache = weakref.WeakValueDictionary()
+    _recent = deque(maxlen=BOARDS_KEPT)
+
+    def __init__(self, N, library, width=None, blocked=()):
+        """
+        :param N: integer, the number of rows of the grid
+        :param library: dictionary mapping block names to their shapes
+        :param width: integer, the number of columns (default N)
+        :param blocked: the cells (row, col) that can't be covered
+        """
+        if width is None:
+            width = N
+        self.N = N
+        self.width = width
+        self.blocked = frozenset(blocked)
+        self.lib = library
+
+        # width of the padding, and of one padded row, in bits
+        self.pad = border_width(library)
+        self.stride = width + self.pad
+
+        # every padding and blocked cell, set once and never cleared
+        self.border = 0
+        for y in range(N + self.pad):
+            for x in range(self.stride):
+                if y >= N or x >= width or (y, x) in self.blocked:
+                    self.border |= 1 << (y * self.stride + x)
+
+        # every open cell of the grid proper, and how many there are
+        self.inside = ((1 << ((N + self.pad) * self.stride)) - 1) & ~self.border
+        self.area = self.inside.bit_count()
+
+        # shape masks anchored at row 0, col 0, their cell counts, and
+        # the (row, col) offsets of their cells
+        self.masks = {}
+        self.sizes = {}
+        self.offsets = {}
+        for b, shape in library.items():
+            mask = 0
+            self.offsets[b] = []
+            for y in range(len(shape)):
+                for x in range(len(shape[y])):
+                    if shape[y][x] == "*":
+                        mask |= 1 << (y * self.stride + x)
+                        self.offsets[b].append((y, x))
+            self.masks[b] = mask
+            self.sizes[b] = mask.bit_count()
+
+        # every placement that fits inside the border, numbered in the
+        # order block, row, col.  The numbers are what a State's live
+        # index holds.
+        self.keys = []      # id -> (b, row, col)
+        self.ids = {}       # (b, row, col) -> id
+        self.pmasks = []    # id -> mask covered
+        self.cells = []     # id -> tuple of the cells (bit positions) covered
+        covering = {}
+        for b in library:
+            cells = bit_positions(self.masks[b])
+            for row in range(N):
+                for col in range(width):
+                    mask = self.placement(b, row, col)
+                    if mask & self.border:
+                        continue
+                    pid = len(self.keys)
+                    offset = row * self.stride + col
+                    self.keys.append((b, row, col))
+                    self.ids[(b, row, col)] = pid
+                    self.pmasks.append(mask)
+                    self.cells.append(tuple(c + offset for c in cells))
+                    for c in self.cells[pid]:
+                        covering.setdefault(c, []).append(pid)
+
+        # cell -> the placements that cover it
+        self.covering = {c: tuple(p) for c, p in covering.items()}
+
+        # a random 64-bit Zobrist key for each placement; a State's hash
+        # is the XOR of the keys of its placements.  Seeded, so hashes are
+        # the same in every process.
+        zrand = random.Random(317)
+        self.zobrist = [zrand.getrandbits(64) for pid in self.keys]
+
+    @classmethod
+    def get(cls, N, library, width=None, blocked=()):
+        """ return the shared Board for this grid and library, building it
+        the first time it is asked for
+        """
+        if width is None:
+            width = N
+        blocked = frozenset(blocked)
+        key = (N, width, blocked, id(library))
+        board = cls._cache.get(key)
+        if board is None or board.lib is not library:
+            board = cls(N, library, width, blocked)
+            cls._cache[key] = board
+        recent = cls._recent
+        if not recent or recent[-1] is not board:
+            if board in recent:
+                recent.remove(board)
+            recent.append(board)
+        return board
+
+    @classmethod
+    def find(cls, N, library, width=None, blocked=()):
+        """ return a shared Board whose library has the same shapes as
+        library, even if it is a different dictionary (e.g. one that came
+        out of a pickle)
+        """
+        if width is None:
+            width = N
+        blocked = frozenset(blocked)
+        for board in list(cls._cache.values()):
+            if (board.N == N and board.width == width and board.blocked == blocked
+                    and board.lib == library):
+                return board
+        return cls.get(N, library, width, blocked)
+
+    def placement(self, b, row, col):
+        """ the mask covered by block b placed at row, col
+        """
+        return self.masks[b] << (row * self.stride + col)
+
+    def zobrist_key(self, used):
+        """ the Zobrist hash of a list of placements
+        """
+        key = 0
+        for move in used:
+            key ^= self.zobrist[self.ids[move]]
+        return key
+
+    def free_placements(self, bits):
+        """ the set of placement ids that don't overlap anything in bits
+        """
+        return {pid for pid, mask in enumerate(self.pmasks) if bits & mask == 0}
+
+    def fits_arrays(self, bits, blocks):
+        """ for each block in blocks, an N x width NumPy boolean array that
+        is True wherever the block fits on the grid bits.  Needs NumPy.
+
+        A block overlaps something at (row, col) if any of its cells does,
+        so this ORs together one shifted view of the occupied cells per
+        shape cell: a handful of whole-array operations per block, however
+        big the grid is.
+        """
+        N, W, rows = self.N, self.width, self.N + self.pad
+        raw = numpy.frombuffer(bits.to_bytes((rows * self.stride + 7) // 8, "little"),
+                               dtype=numpy.uint8)
+        occupied = numpy.unpackbits(raw, bitorder="little")[:rows * self.stride]
+        occupied = occupied.reshape(rows, self.stride).astype(bool)
+        fits = {}
+        for b in blocks:
+            hit = numpy.zeros((N, W), dtype=bool)
+            for (y, x) in self.offsets[b]:
+                hit |= occupied[y:y+N, x:x+W]
+            fits[b] = ~hit
+        return fits
+
+    def from_rows(self, grid):
+        """ convert a padded list-of-lists grid into a bitboard
+        """
+        bits = self.border
+        for y in range(self.N):
+            for x in range(self.width):
+                if grid[y][x] != "." and (y, x) not in self.blocked:
+                    bits |= 1 << (y * self.stride + x)
+        return bits
+
+    def to_rows(self, bits):
+        """ convert a bitboard into a padded list-of-lists grid
+
+        . means empty, * means block, # means border or blocked
+        """
+        grid = []
+        for y in range(self.N + self.pad):
+            row = []
+            for x in range(self.stride):
+                if self.border >> (y * self.stride + x) & 1:
+                    row.append("#")
+                elif bits >> (y * self.stride + x) & 1:
+                    row.append("*")
+                else:
+                    row.append(".")
+            grid.append(row)
+        return grid
+
 
 class State(object):
-    """The Problem State is an array of Boolean values, which we represent by a nested list.  True means a green tile, False a red tile.
-       
+    """The Problem State is a grid of cells, each either empty or covered by a block
+       (or blocked, and never covered).
+       The grid is kept as a bitboard (see Board) so that checking, placing and removing
+       a block are single integer operations.
+
+       States are kept small, since search can hold thousands of them: there is no
+       instance __dict__, the placements are an immutable tuple and the grid an
+       immutable int (so a copy shares both until it changes them), and the block
+       counts are a small array.
     """
-    def __init__(self, gridsize, blocks, used, library, grid=None):
+
+    __slots__ = ("N", "width", "lib", "board", "names", "index", "counts", "used",
+                 "bits", "empty", "zkey", "free", "free_owned", "pending")
+
+    def __init__(self, gridsize, blocks, used, library, grid=None, empty=None, zkey=None,
+                 width=None, blocked=()):
         """
         Initialize the State object.
         
-        gridsize: Integer. The size of a square grid to fill
+        gridsize: Integer. The number of rows of the grid to fill
+            (and of columns too, unless width is given)
         blocks: Dictionary mapping block names to the number
                 still available of that block
         used: List-of-tuples indicating which blocks have been
             placed on the grid and where
         library: Dictionary mapping block names to what they
             look like.  This is NOT copied, but just for reference
+        grid: optional bitboard (an integer) or padded list-of-lists
+            grid to start from
+        empty: optional number of empty cells in grid, if the caller
+            already knows it (saves a recount)
+        zkey: optional Zobrist hash of used, if the caller already
+            knows it
+        width: optional number of columns of the grid
+        blocked: optional cells (row, col) of the grid that can't be
+            covered
         
         """
         self.N = gridsize
-
-        # create a copy of the available block counts
-        self.blocks = dict(blocks)
-
-        # create a copy of current block locations
-        self.used = [x for x in used]
+        if width is None:
+            width = gridsize
+        self.width = width
 
         # DON'T copy the library, there's no need since
         # it shouldn't change
         self.lib = library
 
-        # store the grid contents to make it easier 
-        # to check if pieces can be added later
-        if grid == None:
+        # the available block counts, as an array indexed through
+        # self.index (every orientation of a block shares its count);
+        # the names and index are shared by copies
+        self.names = tuple(blocks)
+        self.index = count_index(self.names, library)
+        self.counts = array("i", blocks.values())
+
+        # current block locations; a tuple, so copies can share it
+        self.used = tuple(used)
+
+        # the shape masks are shared by every State of this size
+        self.board = Board.get(gridsize, library, width, blocked)
+
+        # store the grid contents as one integer, border included,
+        # so that copying a grid is a single assignment
+        if grid is None:
             # if no grid is given, make a blank one
-            self.grid = self.make_grid(self.N)
+            self.bits = self.board.border
+        elif isinstance(grid, int):
+            self.bits = grid
+        else:
+            # a list-of-lists grid, as produced by make_grid()
+            self.bits = self.board.from_rows(grid)
+
+        # running count of empty cells, kept up to date by
+        # place_block() and remove_block()
+        if empty is None:
+            self.empty = self.count_empty()
         else:
-            # if a grid is given, copy it
-            self.grid = []
-            for row in grid:
-                new_row = [x for x in row]
-                self.grid.append(new_row)
+            self.empty = empty
+
+        # Zobrist hash of the placements, kept up to date by
+        # place_block() and remove_block()
+        if zkey is None:
+            self.zkey = self.board.zobrist_key(self.used)
+        else:
+            self.zkey = zkey
+
+        # ids of the placements that fit on the grid as it stands,
+        # regardless of how many blocks are left.  Built on first use by
+        # legal_placements(), then kept up to date incrementally.
+        # A copy shares the set with its original (free_owned is False
+        # for both) and just notes its own (op, id) changes in pending
+        # until it needs the set, so copies that are never searched
+        # from never pay for it.
+        self.free = None
+        self.free_owned = False
+        self.pending = ()
 
+    # to_bytes() layout (little-endian): b'BTS2', uint32 N, uint32 width,
+    # uint16 names, uint16 kinds, each name as uint8 length and UTF-8 bytes,
+    # kinds x int32 counts, uint32 placements x (uint16 name, uint16 row,
+    # uint16 col), uint32 blocked x (uint16 row, uint16 col), then uint32
+    # length and the grid bitmask.  b'BTS1' is the same without the width
+    # and the blocked cells, for square grids; it can still be read.
+    _MAGIC = b"BTS2"
+    _MAGIC_SQUARE = b"BTS1"
+
+    def to_bytes(self):
+        """ return the State as a compact string of bytes: the grid
+        bitmask, the block counts and the placements.  See from_bytes().
+        """
+        # the counts' names, then any others the placements use (e.g.
+        # orientations)
+        names = list(self.names)
+        for (b, row, col) in self.used:
+            if b not in names:
+                names.append(b)
+        parts = [self._MAGIC, struct.pack("<IIHH", self.N, self.width, len(names),
+                                          len(self.names))]
+        for b in names:
+            name = b.encode("utf-8")
+            parts.append(bytes([len(name)]) + name)
+        parts.append(struct.pack("<%di" % len(self.counts), *self.counts))
+        parts.append(struct.pack("<I", len(self.used)))
+        for (b, row, col) in self.used:
+            parts.append(struct.pack("<HHH", names.index(b), row, col))
+        blocked = sorted(self.board.blocked)
+        parts.append(struct.pack("<I", len(blocked)))
+        for (row, col) in blocked:
+            parts.append(struct.pack("<HH", row, col))
+        grid = self.bits.to_bytes((self.bits.bit_length() + 7) // 8, "little")
+        parts.append(struct.pack("<I", len(grid)) + grid)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, library):
+        """ return the State that to_bytes() turned into data
+            :param library: the block library of the problem
+            :raise ValueError: if data isn't a State, or doesn't agree
+                with itself
+        """
+        if data[:4] == cls._MAGIC:
+            N, width, n_names, n_kinds = struct.unpack_from("<IIHH", data, 4)
+            offset = 16
+        elif data[:4] == cls._MAGIC_SQUARE:
+            N, n_names, n_kinds = struct.unpack_from("<IHH", data, 4)
+            width = N
+            offset = 12
+        else:
+            raise ValueError("not a serialized State")
+        names = []
+        for i in range(n_names):
+            length = data[offset]
+            names.append(data[offset+1:offset+1+length].decode("utf-8"))
+            offset += 1 + length
+        counts = struct.unpack_from("<%di" % n_kinds, data, offset)
+        offset += 4 * n_kinds
+        placed = struct.unpack_from("<I", data, offset)[0]
+        offset += 4
+        used = []
+        for i in range(placed):
+            name, row, col = struct.unpack_from("<HHH", data, offset)
+            used.append((names[name], row, col))
+            offset += 6
+        blocked = []
+        if data[:4] == cls._MAGIC:
+            count = struct.unpack_from("<I", data, offset)[0]
+            offset += 4
+            for i in range(count):
+                blocked.append(struct.unpack_from("<HH", data, offset))
+                offset += 4
+        length = struct.unpack_from("<I", data, offset)[0]
+        offset += 4
+        bits = int.from_bytes(data[offset:offset+length], "little")
+
+        s = cls(N, dict(zip(names, counts)), used, library, grid=bits, width=width,
+                blocked=blocked)
+        covered = s.board.border
+        for (b, row, col) in used:
+            covered |= s.board.placement(b, row, col)
+        if covered != bits:
+            raise ValueError("serialized State's grid doesn't match its placements")
+        return s
+
+    def __getstate__(self):
+        """ pickle without the Board, which every State of a problem shares
+        and which can be rebuilt from the grid size and library
+        """
+        d = {name: getattr(self, name) for name in self.__slots__}
+        d["board"] = self.board.blocked
+        d["free"] = None
+        d["pending"] = ()
+        return d
+
+    def __setstate__(self, d):
+        blocked = d.pop("board")
+        for name, value in d.items():
+            setattr(self, name, value)
+        self.board = Board.find(self.N, self.lib, self.width, blocked)
+        # share the library with the other States of the problem
+        self.lib = self.board.lib
+
+    @property
+    def blocks(self):
+        """ a dictionary mapping block names to the number still
+        available (a copy; use place_block() and remove_block() to
+        change it)
+        """
+        return dict(zip(self.names, self.counts))
+
+    @blocks.setter
+    def blocks(self, blocks):
+        self.names = tuple(blocks)
+        self.index = count_index(self.names, self.lib)
+        self.counts = array("i", blocks.values())
+
+    @property
+    def grid(self):
+        """ the grid as a padded list-of-lists-of-strings (read only)
+        """
+        return self.board.to_rows(self.bits)
 
     def make_grid(self, N):
         """ creates a list-of-lists-of-strings that represents the 
@@ -63,19 +584,13 @@ class State(object):
         We pad it with a border to make the logic for 
         out-of-bounds checks easier.
         
-        . means empty, * means block, # means border
+        . means empty, * means block, # means border or blocked
         
-        N: integer, the size of the grid
+        N: integer, the number of rows of the grid (the columns and
+            blocked cells are this State's)
         """
-        grid = []
-        for i in range(N):
-            row = ["."] * N + ["#"] * 3
-            grid.append(row)
-        for j in range(3):
-            row = ["#"] * (N+3)
-            grid.append(row)
-
-        return grid
+        board = Board.get(N, self.lib, self.width, self.board.blocked)
+        return board.to_rows(board.border)
 
     def place_block(self, b, row, col):
         """ places the block b onto the grid at the given
@@ -84,13 +599,18 @@ class State(object):
         pre-condition: the placement is legal
         """
         move = (b, row, col)
-        self.blocks[b] -= 1
-        self.used.append(move)
-        shape = self.lib[b]
-        for y in range(len(shape)):
-            for x in range(len(shape[y])):
-                if shape[y][x] == "*":
-                    self.grid[row+y][col+x] = shape[y][x]
+        # look the placement up first, so a bad one changes nothing
+        pid = self.board.ids[move]
+        self.counts[self.index[b]] -= 1
+        self.used += (move,)
+        self.bits |= self.board.pmasks[pid]
+        self.empty -= self.board.sizes[b]
+        self.zkey ^= self.board.zobrist[pid]
+        if self.free is not None:
+            if self.free_owned:
+                self._placed(pid)
+            else:
+                self.pending += ((ADD, pid),)
 
     def remove_block(self, b, row, col):
         """ remove a block from the grid at location row, col
@@ -98,45 +618,155 @@ class State(object):
         pre-condition: there is a correct block at that location
         """
         move = (b, row, col)
-        self.blocks[b] += 1
-        self.used.remove(move)
-        shape = self.lib[b]
-        for y in range(len(shape)):
-            for x in range(len(shape[y])):
-                if shape[y][x] == "*":
-                    self.grid[row+y][col+x] = "."
+        pid = self.board.ids[move]
+        i = self.used.index(move)
+        self.counts[self.index[b]] += 1
+        self.used = self.used[:i] + self.used[i+1:]
+        self.bits &= ~self.board.pmasks[pid]
+        self.empty += self.board.sizes[b]
+        self.zkey ^= self.board.zobrist[pid]
+        if self.free is not None:
+            if self.free_owned:
+                self._removed(pid)
+            else:
+                self.pending += ((REMOVE, pid),)
+
+    def _placed(self, pid):
+        """ update the free set after placement pid is placed
+        """
+        # only the placements overlapping this one stop fitting
+        covering = self.board.covering
+        for c in self.board.cells[pid]:
+            self.free.difference_update(covering[c])
+
+    def _removed(self, pid):
+        """ update the free set after placement pid is removed
+        """
+        # only the placements overlapping this one can start fitting
+        board = self.board
+        for c in board.cells[pid]:
+            for p in board.covering[c]:
+                if self.bits & board.pmasks[p] == 0:
+                    self.free.add(p)
+
+    def apply_move(self, move):
+        """ make a move, given as (op, block, row, col), on this State
+        
+        pre-condition: the move is legal
+        """
+        op, b, row, col = move
+        if op == ADD:
+            self.place_block(b, row, col)
+        else:
+            self.remove_block(b, row, col)
+
+    def undo_move(self, move):
+        """ take back a move made by apply_move()
+        """
+        op, b, row, col = move
+        if op == ADD:
+            self.remove_block(b, row, col)
+        else:
+            self.place_block(b, row, col)
+
+    def copy(self):
+        """ return an independent copy of this State
+        """
+        s = State.__new__(State)
+        s.N = self.N
+        s.width = self.width
+        s.lib = self.lib
+        s.board = self.board
+        s.names = self.names
+        s.index = self.index
+        s.counts = array("i", self.counts)
+        s.used = self.used
+        s.bits = self.bits
+        s.empty = self.empty
+        s.zkey = self.zkey
+        # share the free set; whichever State needs to change it first
+        # takes its own copy
+        s.free = self.free
+        s.free_owned = self.free_owned = False
+        s.pending = self.pending
+        return s
+
+    def free_ids(self):
+        """ return the set of ids (see Board) of the placements that fit
+        on the grid as it is, whether or not the block is available.  The
+        set belongs to the State; don't change it.
+        """
+        if self.free is None:
+            self.free = self.board.free_placements(self.bits)
+            self.free_owned = True
+        elif not self.free_owned:
+            # take a copy of the shared set and catch it up.  A placement
+            # ends up in the right state after the last change that
+            # touches it, so replaying the changes against the final
+            # grid is enough.
+            self.free = set(self.free)
+            self.free_owned = True
+            for op, pid in self.pending:
+                if op == ADD:
+                    self._placed(pid)
+                else:
+                    self._removed(pid)
+            self.pending = ()
+        return self.free
+
+    def legal_placements(self, b=None):
+        """ return a list of the legal placements (block, row, col) on this
+        State, optionally only those of block b.  Only blocks that are
+        still available are included.
+        """
+        free = self.free_ids()
+        keys = self.board.keys
+        counts, index = self.counts, self.index
+        if b is not None:
+            if b not in index or counts[index[b]] < 1:
+                return []
+            return [keys[pid] for pid in free if keys[pid][0] == b]
+        available = {n for n in self.lib if n in index and counts[index[n]] > 0}
+        return [keys[pid] for pid in free if keys[pid][0] in available]
+
+    def available(self, b):
+        """ returns the number of block b still available (0 if b
+        isn't in the inventory at all)
+        """
+        i = self.index.get(b)
+        if i is None:
+            return 0
+        return self.counts[i]
 
     def legal_move(self, b, row, col):
         """ returns true if it is legal to place block b
         at location row, col
         """
         # No block of that type
-        if b not in self.blocks or self.blocks[b] < 1:
+        i = self.index.get(b)
+        if i is None or self.counts[i] < 1:
             return False
 
-        legal = True
-        shape = self.lib[b]
-        for y in range(len(shape)):
-            for x in range(len(shape[y])):
-                if shape[y][x] == "*":
-                    if self.grid[row+y][col+x] != ".":
-                        legal = False
-        return legal
+        # off the grid (only placements inside the border are numbered;
+        # a shifted mask could fall past the padding or wrap a row)
+        pid = self.board.ids.get((b, row, col))
+        if pid is None:
+            return False
+        return self.bits & self.board.pmasks[pid] == 0
 
     def __str__(self):
         """ A string representation of the State 
         Display the grid, cutting off the internal padding,
         and the number of blocks remaining """
         s = []
-        for row in self.grid:
-            row = "".join(row[0:-3])
+        for row in self.grid[:self.N]:
+            row = "".join(row[:self.width])
             s.append(row)
 
-        s = s[0:-3]
         s = "\n".join(s)
         s += "\n"
         s += "Block locations: \n"
-        s += str(self.used)
+        s += str(list(self.used))
         s += "\n"
         s += "Fitness score:\n"
         s += str(self.get_score())
@@ -150,23 +780,51 @@ class State(object):
         in the same place and have the same blocks left.
         
         """
+        # the hashes differ for almost every pair of different states,
+        # so only build the sets when they match
+        if self.zkey != other.zkey or self.bits != other.bits:
+            return False
         # use 'set()' because we don't care about order
         # of blocks in the list of used blocks
-        return set(self.used) == set(other.used) and self.blocks == other.blocks
+        return (set(self.used) == set(other.used) and self.names == other.names
+                and self.counts == other.counts)
 
+    def canonical_key(self):
+        """ A key that is the same for this State and for every rotation
+        and reflection of it: the smallest image of the grid, with the
+        blocks left.  Only the rotations and reflections that keep the
+        shape of the grid and its blocked cells count.
+        """
+        stride, W = self.board.stride, self.width
+        row_mask = (1 << W) - 1
+        # each row as a string, column 0 first, with the blocked cells
+        # marked so that an image only matches a grid blocked the same way
+        rows = [format((self.bits >> (y * stride)) & row_mask, "0%db" % W)[::-1]
+                for y in range(self.N)]
+        for (y, x) in self.board.blocked:
+            rows[y] = rows[y][:x] + "#" + rows[y][x+1:]
+        return (min(symmetries(rows)), tuple(self.counts))
 
+    def __hash__(self):
+        """ The Zobrist hash of the placements, so equal states hash
+        equal whatever order their blocks were placed in.
+        """
+        return self.zkey
 
     def get_score(self):
-        """ compute the fitness score for a state
+        """ the fitness score for a state: the number of empty grid spaces
         """
-        #TODO: Decide on a fitness score, implement it
-        # fitness score = number of empty grid spaces
-        empty_grid_spaces = 0                       # Initialize number of empty grid spaces to 0
-        for y in range(len(self.grid)):             # Loop through all columns in grid
-            for x in range(len(self.grid[y])):      # Loop through all rows in grid
-                if self.grid[y][x] == ".":          # Check if grid space is empty
-                    empty_grid_spaces += 1          # Increment total number of empty grid spaces if empty
-        return empty_grid_spaces                    # Return total number of empty grid spaces
+        if CHECK_SCORE:
+            assert self.empty == self.count_empty(), "running score is out of date"
+        return self.empty
+
+    def count_empty(self):
+        """ count the empty grid spaces from scratch
+        """
+        # the border (blocked cells included) is always set, so don't
+        # count it as covered
+        covered = self.bits.bit_count() - self.board.border.bit_count()
+        return self.board.area - covered
 
 
     def is_better_than(self, other):
@@ -193,172 +851,596 @@ class State(object):
             :param: str: a block
             :return: boolean
         """
-        if self.blocks[block] > 0:
+        if self.counts[self.index[block]] > 0:
             return True
         else:
             return False
 
 
+class TranspositionTable(object):
+    """A bounded cache of what has already been worked out about States,
+    keyed by their Zobrist hash.  When it is full, the least recently used
+    entry is dropped.
+
+    The cached move and neighbour lists are shared, so callers must not
+    change them (or the States in them).
+    """
+
+    def __init__(self, size, symmetric=False):
+        """
+        :param size: the most States to remember
+        :param symmetric: if True, scores are shared by States that are
+            rotations or reflections of each other
+        """
+        self.size = size
+        self.symmetric = symmetric
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def entry(self, s, key=None):
+        """ return the cache entry for s, a dictionary, creating an empty
+        one if s hasn't been seen (or has been forgotten)
+        """
+        if key is None:
+            key = s.zkey
+        e = self.entries.get(key)
+        if e is None:
+            self.misses += 1
+            e = {"score": s.get_score()}
+            self.entries[key] = e
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return e
+
+    def score(self, s):
+        """ the cached score of s
+        """
+        if self.symmetric:
+            return self.entry(s, s.canonical_key())["score"]
+        return self.entry(s)["score"]
+
+    def __len__(self):
+        return len(self.entries)
+
+
 class Problem(object):
     """The Problem class defines aspects of the problem.
 
     """
 
-    def __init__(self, gridsize, blocks):
+    def __init__(self, gridsize, blocks, cache_size=0, vectorized=None,
+                 orientations=False, symmetry=False, initial=(), seed=None,
+                 width=None, blocked=()):
         """ The problem is defined by an empty grid.
         We want to place blocks to cover as much
         of the grid as possible.
 
-            :param gridsize: dimension for a square grid
+            :param gridsize: the number of rows of the grid (and of
+                columns, for a square grid)
             :param blocks: dictionary mapping block names
                 to the number available of that block
+            :param cache_size: if more than 0, remember the moves and
+                neighbours of up to this many States (see
+                TranspositionTable)
+            :param vectorized: True to find legal add-moves with NumPy,
+                False not to; by default NumPy is used if it is installed
+                and the grid has at least as many cells as a square
+                VECTOR_MIN_N across
+            :param orientations: if True, blocks may also be placed
+                rotated or reflected
+            :param symmetry: if True, treat States that are rotations or
+                reflections of each other as the same when caching
+                scores, listing neighbours, restarting hill climbs (see
+                localsearch.random_restart()) and solving exactly.  It
+                implies orientations: a mirror image of a State can only
+                be made, and grown the same way, if its blocks can be
+                mirrored too
+            :param initial: placements (b, row, col) already on the grid
+                in the initial state; they use up blocks like any other
+            :param seed: seed for the problem's random number generator
+            :param width: the number of columns of the grid, if it isn't
+                square
+            :param blocked: cells (row, col) of the grid that can't be
+                covered; they don't count as empty
         """
         # dimensions of the grid to fill
         self.N = gridsize
+        if width is None:
+            width = gridsize
+        self.width = width
+
+        # cells that are out of use from the start, as (row, col)
+        self.blocked = tuple(sorted(set((row, col) for (row, col) in blocked)))
+        for (row, col) in self.blocked:
+            if not (0 <= row < gridsize and 0 <= col < width):
+                raise ValueError("blocked cell %d, %d is off the grid" % (row, col))
 
         # initial available blocks
         self.blocks = blocks
 
         # show which spaces on a grid each block
-        # would actually cover
-        self.library = { "+" : [".*.",
-                                "***",
-                                ".*."],
-                         "|" : ["*",
-                                "*",
-                                "*",
-                                "*"],
-                         "L" : ["*..",
-                                "*..",
-                                "***"],
-                         "Z" : ["**.",
-                                ".**"],
-                         "T" : ["***",
-                                ".*.",
-                                ".*."],
-                         "4" : ["*.", # ok it doesn't really look like a 4...
-                                "**",
-                                ".*"],
-                        }
+        # would actually cover; shared by every Problem, so that Problems
+        # of the same size share their Board too
+        if orientations or symmetry:
+            self.library = ORIENTED_LIBRARY
+        else:
+            self.library = LIBRARY
+        self.symmetry = symmetry
+
+        # blocks already on the grid at the start, as (b, row, col)
+        self.initial = tuple(initial)
+
+        # the source of every random choice; one per problem, so runs can
+        # be repeated, and run side by side without disturbing each other
+        self.rng = random.Random(seed)
+
+        # States we have already generated moves or neighbours for
+        if cache_size > 0:
+            self.cache = TranspositionTable(cache_size, symmetry)
+        else:
+            self.cache = None
+
+        if vectorized is None:
+            vectorized = numpy is not None and gridsize * width >= VECTOR_MIN_N ** 2
+        elif vectorized and numpy is None:
+            raise ImportError("vectorized=True needs NumPy")
+        self.vectorized = vectorized
 
 
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        # Problems pickled before grids could be rectangular or blocked
+        self.__dict__.setdefault("width", self.N)
+        self.__dict__.setdefault("blocked", ())
+        # share the library, and so the Board, with the other Problems of
+        # the same size, rather than building a Board for this copy
+        for library in (LIBRARY, ORIENTED_LIBRARY):
+            if self.library == library:
+                self.library = library
+
+    def fingerprint(self):
+        """ A string that identifies the instance: the same for any two
+        Problems with the same grid size, blocked cells, blocks, starting
+        placements and shapes, whatever order they were given in.
+        """
+        blocks = sorted((b, n) for b, n in self.blocks.items() if n > 0)
+        instance = [self.N, blocks, sorted(self.initial), sorted(self.library.items())]
+        # square grids with nothing blocked keep the fingerprints they had
+        # before grids could be anything else
+        if self.width != self.N or self.blocked:
+            instance.append([self.width, self.blocked])
+        data = json.dumps(instance)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def state_from_bytes(self, data):
+        """ return a State of this problem from State.to_bytes()
+        """
+        return State.from_bytes(data, self.library)
+
     def create_initial_state(self):
         """ returns an initial state.
         """
-        s = State(self.N, self.blocks, [], self.library)
+        s = State(self.N, self.blocks, [], self.library, width=self.width,
+                  blocked=self.blocked)
+        for (b, row, col) in self.initial:
+            if (b, row, col) not in s.board.ids or not s.legal_move(b, row, col):
+                raise ValueError("initial block %s does not fit at %d, %d" % (b, row, col))
+            s.place_block(b, row, col)
         return s
 
     def objective_function(self, state):
         """
             score calculation is done at the state level
         """
+        if self.cache is not None:
+            return self.cache.score(state)
         return state.get_score()
 
     def n_choose_k(self, n, k):
         return M.factorial(n) / ( M.factorial(n-k) * M.factorial(k) )
 
+    def seed(self, seed=None):
+        """ Restart the problem's random number generator, which every
+        random choice the problem makes comes from.
+            :param seed: any value random.seed() takes; None for a random one
+        """
+        self.rng.seed(seed)
+
     def random_state(self):
         """ Return a random State, completely independent of any other State.
-    
+
+        A random number of blocks is placed, each one chosen uniformly
+        from the placements that are legal at that point.  The placements
+        are looked at in a random order, each at most once: one that isn't
+        legal when it comes up never will be again, since blocks are only
+        added, so nothing has to be retried.
+        """
+        rng = self.rng
+        state = self.create_initial_state()
+        board = state.board
+        pmasks, keys = board.pmasks, board.keys
+        counts, index = state.counts, state.index
+        wanted = rng.randint(0, sum(self.blocks.values()))
+        if VERBOSE:
+            print('Number of random blocks trying to place: ' + str(wanted))
+
+        # a random permutation of the placement ids, drawn one at a time
+        # (Fisher-Yates, remembering only the swapped entries)
+        swapped = {}
+        n = len(keys)
+        for i in range(n):
+            if wanted == 0:
+                break
+            j = rng.randrange(i, n)
+            pid = swapped.get(j, j)
+            swapped[j] = swapped.get(i, i)
+            b, row, col = keys[pid]
+            k = index.get(b)
+            if k is not None and counts[k] > 0 and state.bits & pmasks[pid] == 0:
+                state.place_block(b, row, col)
+                wanted -= 1
+        if VERBOSE:
+            print('Placed', len(state.used), 'blocks')
+        return state
+
+    def random_states(self, k):
+        """ Return a list of k random States, as random_state() makes them.
         """
-        #TODO: Implement an algorithm that will generate a reasonably random state
-        # Place a random number of blocks on the grid at random points if allowed
-        shapes = {0: "+", 1: "|", 2: "L", 3: "Z", 4: "T", 5: "4"}
+        return [self.random_state() for i in range(k)]
+
+    def greedy_state(self, rule="bottom-left"):
+        """ Return a State built by visiting the cells of the grid one at a
+        time, and covering each one that is still empty with the biggest
+        available block that fits there.  Blocks of the same size are
+        chosen between at random, so each call can give a different State.
+
+            :param rule: the order the cells are visited in:
+                "bottom-left": from the bottom row up, left to right; a
+                    block goes where its own bottom-left cell lands on
+                    the cell
+                "constrained": the empty cell that the fewest legal
+                    placements cover comes next, and any of those
+                    placements can be used
+        """
+        if rule == "bottom-left":
+            return self._bottom_left_state()
+        if rule == "constrained":
+            return self._constrained_state()
+        raise ValueError("unknown rule: " + str(rule))
+
+    def _bottom_left_state(self):
+        rng = self.rng
+        state = self.create_initial_state()
+        board = state.board
+        ids, pmasks, sizes = board.ids, board.pmasks, board.sizes
+        counts, index = state.counts, state.index
+
+        # the blocks, biggest first, each with its bottom-left cell
+        shapes = [b for b in self.library if b in index]
+        shapes.sort(key=lambda b: -sizes[b])
+        anchors = {b: max(board.offsets[b], key=lambda cell: (cell[0], -cell[1]))
+                   for b in shapes}
+
+        for row in range(self.N - 1, -1, -1):
+            for col in range(self.width):
+                if state.bits >> (row * board.stride + col) & 1:
+                    continue
+                best, best_size = [], 0
+                for b in shapes:
+                    if sizes[b] < best_size:
+                        break
+                    if counts[index[b]] < 1:
+                        continue
+                    y, x = anchors[b]
+                    pid = ids.get((b, row - y, col - x))
+                    if pid is not None and state.bits & pmasks[pid] == 0:
+                        best.append(pid)
+                        best_size = sizes[b]
+                if best:
+                    state.place_block(*board.keys[rng.choice(best)])
+        return state
+
+    def _constrained_state(self):
+        rng = self.rng
         state = self.create_initial_state()
-        total_number_of_blocks = sum(self.blocks.values())
-        number_of_random_blocks = random.randint(0, total_number_of_blocks)
-        number_of_random_attempts = random.randint(1, 100)
-        print('Number of random blocks trying to place: ' + str(number_of_random_blocks) + '\nNumber of random attempts to place each block: ' + str(number_of_random_attempts))
-        while number_of_random_blocks > 0:
-            block = shapes[random.randint(0, 5)]
-            move_successful = False
-            if state.quantity_of_block_remaining(block):
-                #print('Trying to place block: ' + str(block))
-                attempts_remaining = number_of_random_attempts
-                while attempts_remaining > 0 and move_successful == False:
-                    place_x = random.randint(0, self.N - 1)
-                    place_y = random.randint(0, self.N - 1)
-                    if state.legal_move(block, place_x, place_y):
-                        state.place_block(block, place_x, place_y)
-                        move_successful = True
-                        #print('SUCCESSFULLY placed at position (' + str(place_x) + ',' + str(place_y) + ')')
-                    #else:
-                        #print('FAILED to place at position (' + str(place_x) + ',' + str(place_y) + ')')
-                    attempts_remaining -= 1
-                number_of_random_blocks -= 1
+        board = state.board
+        keys, sizes, covering = board.keys, board.sizes, board.covering
+        counts, index = state.counts, state.index
+        free = state.free_ids()
+
+        def usable(pid):
+            # the placement fits and its block is available
+            c = index.get(keys[pid][0])
+            return pid in free and c is not None and counts[c] > 0
+
+        def options(cell):
+            # the legal placements covering cell
+            return [pid for pid in covering.get(cell, ()) if usable(pid)]
+
+        # how many legal placements cover each empty cell, kept exact as
+        # blocks are placed, and a heap of the cells by it.  A cell gets a
+        # fresh entry whenever its count changes; entries that are out of
+        # date are dropped when they come to the top.
+        ties = {}
+        live = {}
+
+        def count_all():
+            heap = []
+            for cell in bit_positions(board.inside & ~state.bits):
+                if cell not in ties:
+                    ties[cell] = rng.random()
+                live[cell] = len(options(cell))
+                heap.append((live[cell], ties[cell], cell))
+            heapq.heapify(heap)
+            return heap
+
+        heap = count_all()
+        while heap:
+            n, tie, cell = heapq.heappop(heap)
+            if state.bits >> cell & 1 or live[cell] != n:
+                continue
+            if n == 0:
+                # nothing will ever cover it now
+                continue
+            found = options(cell)
+            biggest = max(sizes[keys[pid][0]] for pid in found)
+            pid = rng.choice([pid for pid in found if sizes[keys[pid][0]] == biggest])
+            # the legal placements that this one rules out, itself included
+            gone = {other for c in board.cells[pid] for other in covering.get(c, ())
+                    if usable(other)}
+            state.place_block(*keys[pid])
+            if counts[index[keys[pid][0]]] == 0:
+                # that was the last of the block: count everything again
+                heap = count_all()
+                continue
+            changed = set()
+            for other in gone:
+                for c in board.cells[other]:
+                    live[c] -= 1
+                    changed.add(c)
+            for c in changed:
+                if not state.bits >> c & 1:
+                    heapq.heappush(heap, (live[c], ties[c], c))
         return state
 
 
+    def moves(self, s):
+        """ return a list of all the moves that lead from s to one of its
+        neighbours.  A move is a tuple (op, block, row, col); see
+        State.apply_move().
+
+        The neighbourhood is: remove any one placed block, or add any
+        available block at any location where it fits.
+        """
+        if self.cache is not None:
+            entry = self.cache.entry(s)
+            if "moves" not in entry:
+                entry["moves"] = self._moves(s)
+            return entry["moves"]
+        return self._moves(s)
+
+    def _moves(self, s):
+        """ the moves of s, worked out from scratch
+        """
+        moves = []
+        # Remove each block
+        for (block, row, col) in s.used:
+            moves.append((REMOVE, block, row, col))
+        # Add each available block at each location where it fits
+        for (block, row, col) in s.legal_placements():
+            moves.append((ADD, block, row, col))
+        return moves
+
+    def delta(self, s, move):
+        """ return the change in the score of s that move would make,
+        without making it.  Negative is better.
+        """
+        size = s.board.sizes[move[1]]
+        if move[0] == ADD:
+            return -size
+        return size
+
+    def iter_moves(self, s):
+        """ generate the moves of s (see moves()) one at a time, in a
+        random order.  Little is worked out ahead of the move asked for,
+        so stopping early, e.g. at the first improvement, saves the cost
+        of the rest: while most placements fit, ids are drawn from all of
+        them and the ones that don't fit are skipped; only when few fit
+        are those listed first.  s must not change while this is in use.
+        """
+        rng = self.rng
+        free = s.free_ids()
+        used = s.used
+        keys = s.board.keys
+        counts, index = s.counts, s.index
+        if 4 * len(free) >= len(keys):
+            # at most 3 draws in 4 are wasted
+            listed = None
+            n_add = len(keys)
+        else:
+            listed = list(free)
+            n_add = len(listed)
+        n = n_add + len(used)
+
+        # a random permutation of the adds then the removes, drawn one at
+        # a time (Fisher-Yates, remembering only the swapped entries)
+        swapped = {}
+        for i in range(n):
+            j = rng.randrange(i, n)
+            k = swapped.get(j, j)
+            swapped[j] = swapped.get(i, i)
+            if k >= n_add:
+                yield (REMOVE,) + used[k - n_add]
+                continue
+            if listed is not None:
+                k = listed[k]
+            elif k not in free:
+                continue
+            b, row, col = keys[k]
+            c = index.get(b)
+            if c is not None and counts[c] > 0:
+                yield (ADD, b, row, col)
+
+    def iter_neighbors(self, s):
+        """ generate the neighbours of s one at a time, in a random order
+        (see iter_moves())
+        """
+        for move in self.iter_moves(s):
+            new_state = s.copy()
+            new_state.apply_move(move)
+            yield new_state
+
     def neighbors(self, s):
         """ return a list of all neighbors of the given state.
-    
-      
         """
-        # list of states that are neighbors to the given state
-        neighbors = []
-        shapes = {0: "+", 1: "|", 2: "L", 3: "Z", 4: "T", 5: "4"}
-        # example of how to make one copy of the given state, s
+        if self.cache is not None:
+            entry = self.cache.entry(s)
+            if "neighbors" not in entry:
+                entry["neighbors"] = self._neighbors(s)
+            return entry["neighbors"]
+        return self._neighbors(s)
 
-        #TODO: Define a neighborhood and fill the list of neighbors
-        # with all the neighboring states to s
-        new_state = State(s.N, s.blocks, s.used, s.lib, s.grid)
-        # Remove each block
-        for i in range(len(s.used)):
-            move = s.used[i]
-            block = move[0]
-            x_pos = move[1]
-            y_pos = move[2]
-            new_state.remove_block(block, x_pos, y_pos)
+    def _neighbors(self, s):
+        """ the neighbours of s, built from scratch
+        """
+        neighbors = []
+        seen = set()
+        for move in self.moves(s):
+            new_state = s.copy()
+            new_state.apply_move(move)
+            if self.symmetry:
+                # keep only one of each set of mirror images
+                key = new_state.canonical_key()
+                if key in seen:
+                    continue
+                seen.add(key)
             neighbors.append(new_state)
-            new_state = State(s.N, s.blocks, s.used, s.lib, s.grid)
-        new_state = State(s.N, s.blocks, s.used, s.lib, s.grid)
-        # Add each type of block
-        for i in range(5):
-            block = shapes[i]
-            # at each possible location
-            for y in range(self.N - 1):  # Loop through all columns in grid
-                for x in range(self.N - 1):  # Loop through all rows in grid
-                    if s.legal_move(block, x, y):
-                        new_state.place_block(block, x, y)
-                        neighbors.append(new_state)
-                        new_state = State(s.N, s.blocks, s.used, s.lib, s.grid)
         return neighbors
 
+    def random_move(self, state):
+        """ Return a random move from the given State, or None if there
+            are no moves at all.
+            :param: state: A State object
+        """
+        A = self.moves(state)
+        if len(A) == 0:
+            return None
+        return self.rng.choice(A)
+
+    def add_moves(self, state):
+        """ Return the legal add-moves of the given State, grouped by block,
+            as a list of (block, delta, places): places is a sequence of
+            (row, col) pairs where the block fits (a NumPy array when the
+            problem is vectorized) and delta is the score change of any of
+            them.  Blocks with nowhere to go are left out.
+            :param: state: A State object
+        """
+        available = [b for b in self.library if state.available(b) > 0]
+        groups = []
+        if self.vectorized:
+            fits = state.board.fits_arrays(state.bits, available)
+            for b in available:
+                places = numpy.argwhere(fits[b])
+                if len(places) > 0:
+                    groups.append((b, -state.board.sizes[b], places))
+            return groups
+
+        places = {b: [] for b in available}
+        for (b, row, col) in state.legal_placements():
+            places[b].append((row, col))
+        for b in available:
+            if len(places[b]) > 0:
+                groups.append((b, -state.board.sizes[b], places[b]))
+        return groups
+
+    def best_move(self, state):
+        """ Return the move with the lowest delta from the given State,
+            and that delta, as a pair.  The move doesn't have to be an
+            improvement!  Returns (None, 0) if there are no moves at all.
+            :param: state: A State object
+        """
+        best, best_delta = None, 0
+        if self.cache is not None:
+            # the cached move list is cheaper than working them out
+            for move in self.moves(state):
+                d = self.delta(state, move)
+                if best is None or d < best_delta:
+                    best, best_delta = move, d
+            return best, best_delta
+
+        # any add beats any remove, so only look at removes if there
+        # are no adds
+        for (b, d, places) in self.add_moves(state):
+            if best is None or d < best_delta:
+                row, col = places[0]
+                best, best_delta = (ADD, b, int(row), int(col)), d
+        if best is None:
+            for (b, row, col) in state.used:
+                d = state.board.sizes[b]
+                if best is None or d < best_delta:
+                    best, best_delta = (REMOVE, b, row, col), d
+        return best, best_delta
+
+    def random_better_move(self, state):
+        """ Return a random move that improves the given State, or None
+            if there isn't one.
+            :param: state: A State object
+        """
+        if self.cache is not None:
+            better = [m for m in self.moves(state) if self.delta(state, m) < 0]
+            if len(better) > 0:
+                return self.rng.choice(better)
+            return None
+
+        # the better moves are exactly the adds; pick one of them
+        # uniformly without listing them all
+        groups = self.add_moves(state)
+        total = sum(len(places) for (b, d, places) in groups)
+        if total == 0:
+            return None
+        i = self.rng.randrange(total)
+        for (b, d, places) in groups:
+            if i < len(places):
+                row, col = places[i]
+                return (ADD, b, int(row), int(col))
+            i -= len(places)
+
     def random_step(self, state):
         """ Return a State that is a random neighbour of the given State.
             :param: state: A State object
         """
-        A = self.neighbors(state)
-        return rand.choice(A)
-
+        move = self.random_move(state)
+        new_state = state.copy()
+        if move is not None:
+            new_state.apply_move(move)
+        return new_state
 
     def best_step(self, state):
         """ Return the best neighbouring State for the given State.
             It doesn't have to be better than the given State!
             :param: state: A State object
         """
-        A = self.neighbors(state)
-        best = A[0]
-        for s in A:
-            if s.get_score() < best.get_score():
-                best = s
-        return best
+        move, d = self.best_move(state)
+        new_state = state.copy()
+        if move is not None:
+            new_state.apply_move(move)
+        return new_state
 
     def random_better(self, state):
         """ Return a State that is a random BETTER neighbour of the given State.
             Should return None if there isn't one!
             :param: state: A State object
         """
-        better = []
-        A = self.neighbors(state)
-        for s in A:
-            if s.get_score() < state.get_score():
-                better.append(s)
-
-        if len(better) > 0:
-            return rand.choice(better)
-        else:
+        move = self.random_better_move(state)
+        if move is None:
             return None
+        new_state = state.copy()
+        new_state.apply_move(move)
+        return new_state
 
 
 
@@ -0,0 +1,186 @@
+# CMPT 317: A genetic algorithm for the block tiling problem
+
+# A population of States evolves by crossover and mutation:
+#  - crossover makes a child from two parents by cutting the grid at a random
+#    row, taking the first parent's blocks above the cut and the second's
+#    below it, then trying the rest of both parents' blocks in a random order
+#    wherever they still fit.  The child's blocks never overlap, and it never
+#    uses more blocks than there are.
+#  - mutation is a couple of random_step()s of the child.  (One step, or
+#    mutating only some children, lets the population settle far from the
+#    scores simulated annealing gets on tiles3.txt.)
+# Parents are chosen by tournament, and the best State of each generation is
+# always kept.
+#
+# With more than one island, each island is a separate population, and they
+# evolve side by side in a pool of worker processes.  Every few generations
+# (an epoch) the best States of each island migrate to the next island
+# around a ring, replacing its worst.
+#
+# Each island draws its random numbers from the problem's rng, restored from
+# the island's own saved state before each epoch, so a run depends only on
+# the seed, however many workers there are.
+#
+# Usage:
+#   import evolution
+#   solution = evolution.genetic_algorithm(theProblem, generations=50, islands=4,
+#                                          workers=4, seed=317)
+
+import concurrent.futures
+import localsearch as search
+
+
+def crossover(problem, a, b):
+    """ Return a child of two States (see above).
+        :param problem: the Problem, for its initial state and rng
+        :param a, b: the parents
+    """
+    rng = problem.rng
+    child = problem.create_initial_state()
+    cut = rng.randrange(problem.N + 1)
+    first = [p for p in a.used if p[1] < cut] + [p for p in b.used if p[1] >= cut]
+    rest = [p for p in a.used if p[1] >= cut] + [p for p in b.used if p[1] < cut]
+    rng.shuffle(rest)
+    for (block, row, col) in first + rest:
+        if child.legal_move(block, row, col):
+            child.place_block(block, row, col)
+    return child
+
+
+def tournament(problem, population, size):
+    """ the best of size States picked at random from the population
+    """
+    rng = problem.rng
+    best = population[rng.randrange(len(population))]
+    for i in range(size - 1):
+        other = population[rng.randrange(len(population))]
+        if other.is_better_than(best):
+            best = other
+    return best
+
+
+def evolve(problem, population, generations, mutation=2, size=3, budget=None):
+    """ Evolve one population for some generations.
+        :param problem: the Problem
+        :param population: list of States; it is replaced, not changed
+        :param generations: number of generations
+        :param mutation: the number of random steps each child takes
+        :param size: the tournament size
+        :param budget: an optional Budget
+        :return: the new population, best first
+    """
+    if budget is None:
+        budget = search.Budget()
+    score = problem.objective_function
+    population = sorted(population, key=score)
+    for g in range(generations):
+        if budget.exhausted() or score(population[0]) == 0:
+            break
+        # the best State always survives
+        children = [population[0]]
+        while len(children) < len(population) and not budget.exhausted():
+            child = crossover(problem, tournament(problem, population, size),
+                              tournament(problem, population, size))
+            for i in range(mutation):
+                child = problem.random_step(child)
+            budget.spend()
+            children.append(child)
+        # if the budget ran out part way, the next best parents fill up
+        children += population[1:len(population) - len(children) + 1]
+        population = sorted(children, key=score)
+    return population
+
+
+def run_epoch(problem, island, generations, mutation, size, budget):
+    """ Evolve one island for an epoch.
+        :param island: (population, random state)
+        :return: the island afterwards, and the evaluations it spent
+    """
+    population, rng_state = island
+    problem.rng.setstate(rng_state)
+    evals = budget.evals
+    population = evolve(problem, population, generations, mutation, size, budget)
+    return (population, problem.rng.getstate()), budget.evals - evals
+
+
+def _epoch_worker(island, generations, mutation, size, budget):
+    """
+    One epoch of one island, run in a worker process (whose problem
+    localsearch._init_worker() set).
+    """
+    return run_epoch(search._worker_problem, island, generations, mutation, size, budget)
+
+
+def genetic_algorithm(problem, generations=50, population=20, islands=1, workers=1,
+                      epoch=20, migrants=2, mutation=2, size=3, seed=None, budget=None,
+                      init=None):
+    """
+    Solve a problem with a genetic algorithm, on one or more islands.
+    :param problem: a blockTiling.Problem; it has to be picklable if
+                    workers is more than 1
+    :param generations: the number of generations
+    :param population: the number of States on each island
+    :param islands: the number of separate populations
+    :param workers: number of worker processes to evolve islands in
+    :param epoch: generations between migrations
+    :param migrants: States that move to the next island each migration
+    :param mutation: the number of random steps each child takes
+    :param size: the tournament size
+    :param seed: seed for the run (default: drawn from problem.rng)
+    :param budget: an optional Budget
+    :param init: how to make the starting States (see
+                 localsearch.restart_init())
+    :return: the best state seen in the process
+    """
+    if budget is None:
+        budget = search.Budget()
+    if seed is None:
+        seed = problem.rng.randrange(2**32)
+
+    # the starting populations, each island with its own random numbers
+    state = problem.rng.getstate()
+    places = []
+    for i in range(islands):
+        problem.seed(seed + i)
+        places.append(([search.initial_state(problem, search.restart_init(init, i * population + j))
+                        for j in range(population)],
+                       problem.rng.getstate()))
+    problem.rng.setstate(state)
+    budget.spend(islands * population)
+    for (members, rng_state) in places:
+        for s in members:
+            budget.offer(s)
+
+    pool = None
+    if workers > 1 and islands > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, islands),
+                                                      initializer=search._init_worker,
+                                                      initargs=(problem,))
+    try:
+        done = 0
+        while done < generations and not budget.exhausted() and budget.best.get_score() > 0:
+            steps = min(epoch, generations - done)
+            # the islands split the evaluations left
+            shares = budget.shares(islands)
+            if pool is None:
+                results = [run_epoch(problem, island, steps, mutation, size, share)
+                           for island, share in zip(places, shares)]
+            else:
+                results = list(pool.map(_epoch_worker, places, [steps] * islands,
+                                        [mutation] * islands, [size] * islands, shares))
+            places = [island for (island, evals) in results]
+            budget.spend(sum(evals for (island, evals) in results))
+            done += steps
+            for (members, rng_state) in places:
+                budget.offer(members[0])
+
+            # the best of each island replace the worst of the next
+            m = min(migrants, population - 1)
+            if islands > 1 and m > 0:
+                moving = [members[:m] for (members, rng_state) in places]
+                for i, (members, rng_state) in enumerate(places):
+                    members[-m:] = moving[i - 1]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return budget.best
@@ -0,0 +1,386 @@
+# CMPT 317: An exact solver for the block tiling problem
+
+# Branch and bound over the cells of the grid, in row-major order.  The first
+# empty cell is either covered by some block whose first cell lands on it, or
+# left empty for good.  A branch is cut off when the cells already left empty,
+# plus the cells that the remaining blocks can't possibly cover, is no better
+# than the best tiling found so far.  Sub-boards that come up again (the same
+# cells filled with the same blocks left) are looked up instead of searched.
+#
+# If the problem has symmetry turned on (which means every block comes in
+# every orientation), a sub-board is worth as much as its left-right mirror
+# image.  At the start of each row, where the search keeps meeting mirror
+# images of sub-boards it has already done, the two are looked up as one.
+#
+# On boards the size of tiles1.txt and tiles2.txt this proves the optimal
+# score in milliseconds.  On bigger boards it can be given a deadline, and
+# then reports the best tiling it found and a lower bound on the score, which
+# is how far off a local search result could be.
+#
+# Usage:
+#   import exact
+#   result = exact.solve(theProblem, deadline=1.0)
+#   # result.state is a State, result.score its score, result.lower_bound
+#   # a proven lower bound, and result.optimal is True if they are equal
+
+import itertools
+import sys
+import time
+
+
+# roughly how many bytes the memo of sub-boards may take; when it is full
+# the older half of it is forgotten
+MEMO_BYTES = 64 * 2**20
+
+
+class OutOfTime(Exception):
+    """Raised inside the search when the deadline passes.
+    """
+
+
+class Result(object):
+    """What the exact solver found.
+    """
+
+    def __init__(self, state, score, lower_bound, nodes, seconds):
+        """
+        :param state: the best State found, or None if nothing beat the
+                      incumbent it was given
+        :param score: the score of the best tiling known (an upper bound)
+        :param lower_bound: no tiling scores less than this; if the search
+                            didn't finish, only a weak bound from the cells
+                            that can't be covered
+        :param nodes: the number of search nodes expanded
+        :param seconds: the time the search took
+        """
+        self.state = state
+        self.score = score
+        self.lower_bound = lower_bound
+        self.optimal = score == lower_bound
+        self.nodes = nodes
+        self.seconds = seconds
+
+    def gap(self, score):
+        """ How far a score is above the lower bound.
+        """
+        return score - self.lower_bound
+
+    def __str__(self):
+        if self.optimal:
+            return "Optimal score: %d (%d nodes, %.3f secs)" % (self.score, self.nodes, self.seconds)
+        # the search ran out of time, so the bound is only the cells that
+        # plainly can't be covered, and is usually far below the optimum
+        return ("Best score: %d, not proved optimal; lower bound: %d, from the cells "
+                "that can't be covered (%d nodes, %.3f secs)" % (
+                    self.score, self.lower_bound, self.nodes, self.seconds))
+
+
+class Solver(object):
+    """The search for one problem.  Use solve() rather than this directly.
+    """
+
+    def __init__(self, problem, deadline=None, start=None):
+        """
+        :param problem: a blockTiling.Problem
+        :param deadline: number of seconds the search may take, or None
+        :param start: the State to add blocks to, with the blocks it has
+                      left (default: the problem's initial state)
+        """
+        self.problem = problem
+        if start is None:
+            start = problem.create_initial_state()
+        self.start = start
+        self.board = self.start.board
+
+        # the shapes we have, largest first, so good tilings come early;
+        # the orientations of a block are separate shapes that share
+        # one count
+        names = [b for b in problem.library if self.start.available(b) > 0]
+        names.sort(key=lambda b: -self.board.sizes[b])
+        self.names = names
+        index = self.start.index
+        kinds = []
+        for b in names:
+            if index[b] not in kinds:
+                kinds.append(index[b])
+        # for each shape, which entry of the counts it uses
+        self.kind = [kinds.index(index[b]) for b in names]
+        self.counts = tuple(self.start.counts[i] for i in kinds)
+        # the area of each kind of block
+        self.sizes = [0] * len(kinds)
+        for b, k in zip(names, self.kind):
+            self.sizes[k] = self.board.sizes[b]
+        self.masks = [self.board.masks[b] for b in names]
+        # position of each shape's first cell, relative to its origin
+        self.anchors = [(m & -m).bit_length() - 1 for m in self.masks]
+
+        # every cell of the grid proper (not the border)
+        self.cells = self.board.inside
+
+        # a key is a bitboard of the whole grid, so bigger grids get fewer
+        self.memo = {}
+        key_bytes = self.cells.bit_length() // 8 + 200
+        self.memo_size = max(1000, MEMO_BYTES // key_bytes)
+        self.nodes = 0
+
+        # for each shape, its mirror image and its width, if sub-boards and
+        # their mirror images are to be looked up as one
+        self.mirror = None
+        if getattr(problem, 'symmetry', False):
+            self.mirror = self.mirror_shapes(problem.library)
+
+        # the placements on the path to the current node, the cells given
+        # up on along it, and the best complete tiling seen so far
+        self.placed = []
+        self.waste = 0
+        self.best_score = None
+        self.best_placements = None
+        if deadline is None:
+            self.end = None
+        else:
+            self.end = time.perf_counter() + deadline
+
+    def mirror_shapes(self, library):
+        """ map each shape we have to (its mirror image, its width), or
+        return None if some mirror image isn't in the library
+        """
+        mirror = {}
+        for i, b in enumerate(self.names):
+            image = [row[::-1] for row in library[b]]
+            for j, m in enumerate(self.names):
+                if library[m] == image and self.kind[j] == self.kind[i]:
+                    mirror[b] = (m, max(len(row) for row in image))
+                    break
+            else:
+                return None
+        return mirror
+
+    def flip(self, bits):
+        """ the left-right mirror image of a bitboard of cells of the grid
+        """
+        width, stride = self.board.width, self.board.stride
+        row_mask = (1 << width) - 1
+        image, shift = 0, 0
+        while bits:
+            row = bits & row_mask
+            if row:
+                image |= int(format(row, "0%db" % width)[::-1], 2) << shift
+            bits >>= stride
+            shift += stride
+        return image
+
+    def flip_tail(self, tail):
+        """ the mirror image of a linked list of placements
+        """
+        placements = []
+        while tail is not None:
+            placement, tail = tail
+            placements.append(placement)
+        image = None
+        for (b, row, col) in reversed(placements):
+            m, width = self.mirror[b]
+            image = ((m, row, self.board.width - col - width), image)
+        return image
+
+    def lower_bound(self, filled, counts):
+        """ The cells that can't be covered, whatever we do: more empty
+        cells than the blocks left have room to cover.
+        """
+        area = sum(c * s for c, s in zip(counts, self.sizes))
+        return max(0, (self.cells & ~filled).bit_count() - area)
+
+    def dead_cells(self, filled):
+        """ The empty cells that no placement of a block we have left can
+        cover: these stay empty whatever we do.
+        """
+        board = self.board
+        have = set(self.names)
+        dead = 0
+        free = self.cells & ~filled
+        for cell in range(free.bit_length()):
+            if free >> cell & 1 and not any(
+                    board.keys[pid][0] in have and not board.pmasks[pid] & filled
+                    for pid in board.covering.get(cell, ())):
+                dead += 1
+        return dead
+
+    def remember(self, key, entry):
+        """ Put an entry in the memo, forgetting the older half of it
+        first if it is full.
+        """
+        if len(self.memo) >= self.memo_size:
+            for old in list(itertools.islice(self.memo, len(self.memo) // 2)):
+                del self.memo[old]
+        self.memo[key] = entry
+
+    def record(self, value, tail):
+        """ Note the tiling made of the current path plus tail, which
+        leaves value more cells empty, if it is the best seen so far.
+        """
+        score = self.waste + value
+        if self.best_score is None or score < self.best_score:
+            self.best_score = score
+            self.best_placements = list(self.placed)
+            while tail is not None:
+                placement, tail = tail
+                self.best_placements.append(placement)
+
+    def search(self, filled, counts, cut):
+        """ Find the fewest empty cells that can be left from here, if that
+        is fewer than cut.
+        :param filled: bitboard of the cells covered or given up on
+        :param counts: tuple of the number of each block left
+        :param cut: only answers below this are interesting
+        :return: (value, tail).  If value < cut it is exact and tail is a
+                 linked list (placement, rest) of placements achieving it;
+                 otherwise value is just a lower bound.
+        """
+        self.nodes += 1
+        if self.end is not None and self.nodes % 1024 == 0:
+            if time.perf_counter() >= self.end:
+                raise OutOfTime()
+
+        free = self.cells & ~filled
+        if free == 0:
+            self.record(0, None)
+            return 0, None
+        bound = self.lower_bound(filled, counts)
+        if bound >= cut:
+            return bound, None
+
+        # the first cell still to decide
+        low = free & -free
+        cell = low.bit_length() - 1
+        stride = self.board.stride
+
+        key = (filled, counts)
+        flipped = False
+        if self.mirror is not None and cell % stride == 0:
+            # what the cells left are worth doesn't depend on how the
+            # rest was filled, so key them by the smaller of themselves
+            # and their mirror image; the tail is kept the way round the
+            # key is.  (These keys have no border bits, so they never
+            # clash with the others.)
+            image = self.flip(free)
+            flipped = image < free
+            key = (min(free, image), counts)
+
+        known = self.memo.get(key)
+        if known is not None:
+            value, exact, tail = known
+            if flipped:
+                tail = self.flip_tail(tail)
+            if exact:
+                self.record(value, tail)
+            if exact or value >= cut:
+                return value, tail
+
+        best, best_tail = cut, None
+
+        for i in range(len(self.names)):
+            k = self.kind[i]
+            if counts[k] == 0 or cell < self.anchors[i]:
+                continue
+            origin = cell - self.anchors[i]
+            mask = self.masks[i] << origin
+            if mask & filled:
+                continue
+            left = counts[:k] + (counts[k] - 1,) + counts[k+1:]
+            row, col = divmod(origin, stride)
+            self.placed.append((self.names[i], row, col))
+            value, tail = self.search(filled | mask, left, best)
+            self.placed.pop()
+            if value < best:
+                best, best_tail = value, ((self.names[i], row, col), tail)
+                if best == bound:
+                    break
+
+        # or leave this cell empty
+        if best > bound:
+            self.waste += 1
+            value, tail = self.search(filled | low, counts, best - 1)
+            self.waste -= 1
+            if value + 1 < best:
+                best, best_tail = value + 1, tail
+
+        if best < cut:
+            if flipped:
+                self.remember(key, (best, True, self.flip_tail(best_tail)))
+            else:
+                self.remember(key, (best, True, best_tail))
+        else:
+            self.remember(key, (cut, False, None))
+        return best, best_tail
+
+
+def solve(problem, deadline=None, incumbent=None):
+    """ Find an optimal tiling for a problem, or as good a one as possible
+        before the deadline.
+        :param problem: a blockTiling.Problem
+        :param deadline: number of seconds the search may take, or None
+                         for no limit
+        :param incumbent: optional State already known, e.g. from local
+                          search; the search only looks for better ones
+        :return: a Result
+    """
+    start = time.perf_counter()
+    s = Solver(problem, deadline)
+    filled = s.start.bits
+
+    # room for one level of recursion per cell
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), s.cells.bit_count() + 1000))
+
+    # if the search doesn't finish, this is all we can say for sure: the
+    # cells nothing can cover stay empty, and of the rest, at least those
+    # the blocks left haven't the area to cover
+    dead = s.dead_cells(filled)
+    area = sum(c * size for c, size in zip(s.counts, s.sizes))
+    root_bound = dead + max(0, (s.cells & ~filled).bit_count() - dead - area)
+    if incumbent is None:
+        upper = s.cells.bit_count() + 1
+    else:
+        upper = incumbent.get_score()
+
+    lower = root_bound
+    try:
+        s.search(filled, s.counts, upper)
+        # finished: nothing scores less than the best we have
+        finished = True
+    except OutOfTime:
+        finished = False
+
+    # the best tiling the search got to, if it beat the incumbent
+    state = None
+    if s.best_score is not None and s.best_score < upper:
+        state = problem.create_initial_state()
+        for (b, row, col) in s.best_placements:
+            state.place_block(b, row, col)
+        upper = s.best_score
+    if finished:
+        lower = upper
+
+    return Result(state, upper, lower, s.nodes, time.perf_counter() - start)
+
+
+def repair(problem, start, region, deadline=None):
+    """ Fill part of a grid as well as possible: the empty cells of start
+        that are in region, with the blocks start has left.
+        :param problem: a blockTiling.Problem
+        :param start: a State, which isn't changed
+        :param region: bitboard (see blockTiling.Board) of the cells to fill
+        :param deadline: number of seconds the search may take, or None
+        :return: (placements, empty): the (b, row, col) placements to add,
+                 and the number of cells of the region they leave empty.
+                 If the deadline passes, the best found so far.
+    """
+    s = Solver(problem, deadline, start)
+    filled = start.bits | (s.cells & ~region)
+    empty = (s.cells & ~filled).bit_count()
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), empty + 1000))
+    try:
+        s.search(filled, s.counts, empty + 1)
+    except OutOfTime:
+        pass
+    if s.best_score is None:
+        return [], empty
+    return s.best_placements, s.best_score
@@ -0,0 +1,262 @@
+# CMPT 317: Reading (and writing) block tiling instances in bulk
+
+# A problem file used to hold exactly one instance: the grid size on the first
+# line, then one 'name count' line for each kind of block.  This module reads
+# files with any number of instances, whole directories of them, and a compact
+# binary format, and hands back one Problem at a time, so a sweep over tens of
+# thousands of instances never has them all in memory at once.
+#
+# Text format.  Instances are separated by a line holding just '---'.  Each
+# one is the old format, plus optional 'name row col' lines for blocks that
+# are already on the grid at the start:
+#
+#   5
+#   + 1
+#   L 2
+#   L 0 0        an L already placed at row 0, col 0
+#   ---
+#   7
+#   ...
+#
+# A grid that isn't square has 'rows columns' on its first line instead of
+# the size.  Cells can be blocked with a mask: one line per row of the grid,
+# top first, with '.' for an open cell and 'X' for a blocked one:
+#
+#   3 5
+#   | 2
+#   ..X..
+#   .....
+#   X...X
+#
+# Blank lines and lines starting with '#' are ignored.
+#
+# Binary format (little-endian), which is read through mmap:
+#
+#   b'BTIL', uint16 version
+#   then for each instance:
+#     uint32 N, uint32 width, uint16 names, uint16 kinds
+#     each name: uint8 length, UTF-8 bytes
+#     kinds x uint32: the count of each of the first 'kinds' names
+#     uint32 placed, then placed x (uint16 name, uint16 row, uint16 col)
+#     uint32 blocked, then blocked x (uint16 row, uint16 col)
+#
+# Version 1 files, which have square grids only (no width, nothing blocked),
+# can still be read.
+#
+# Usage:
+#   import instances
+#   for label, theProblem in instances.load(['tiles1.txt', 'sweep/']):
+#       ...
+#   instances.write_binary('sweep.bin', problems)
+
+import mmap
+import os
+import struct
+import blockTiling as P
+
+
+MAGIC = b'BTIL'
+VERSION = 2
+
+SEPARATOR = '---'
+
+# the characters of a mask line
+OPEN = '.'
+BLOCKED = 'X'
+
+_HEADER = struct.Struct('<4sH')
+_INSTANCE = struct.Struct('<IIHH')
+_INSTANCE_V1 = struct.Struct('<IHH')
+_COUNT = struct.Struct('<I')
+_PLACEMENT = struct.Struct('<HHH')
+_CELL = struct.Struct('<HH')
+
+
+def _make_problem(N, width, blocks, initial, mask, options):
+    """ the Problem read from a text instance
+    """
+    blocked = []
+    if mask:
+        if len(mask) != N or any(len(line) != width for line in mask):
+            raise ValueError('the mask of a %d x %d grid has to be %d lines of %d'
+                             % (N, width, N, width))
+        blocked = [(y, x) for y, line in enumerate(mask)
+                   for x, c in enumerate(line) if c == BLOCKED]
+    return P.Problem(N, blocks, initial=initial, width=width, blocked=blocked, **options)
+
+
+def read_text(file, **options):
+    """ Read the instances in a text file, one at a time.
+        :param file: an open text file
+        :param options: passed on to each Problem (cache_size etc.)
+        :return: a generator of Problems
+    """
+    N = width = None
+    blocks = {}
+    initial = []
+    mask = []
+    for number, line in enumerate(file, 1):
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        if fields == [SEPARATOR]:
+            if N is not None:
+                yield _make_problem(N, width, blocks, initial, mask, options)
+            N, width, blocks, initial, mask = None, None, {}, [], []
+            continue
+
+        try:
+            if N is None and len(fields) == 1:
+                N = width = int(fields[0])
+            elif N is None and len(fields) == 2:
+                N, width = int(fields[0]), int(fields[1])
+            elif N is not None and len(fields) == 1 and set(fields[0]) <= {OPEN, BLOCKED}:
+                mask.append(fields[0])
+            elif N is not None and len(fields) == 2:
+                blocks[fields[0]] = int(fields[1])
+            elif N is not None and len(fields) == 3:
+                initial.append((fields[0], int(fields[1]), int(fields[2])))
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError('%s, line %d: %r' % (getattr(file, 'name', 'input'),
+                                                  number, line.rstrip()))
+
+    if N is not None:
+        yield _make_problem(N, width, blocks, initial, mask, options)
+
+
+def read_binary(filename, **options):
+    """ Read the instances in a binary file, one at a time.
+        :param filename: path to the file
+        :param options: passed on to each Problem (cache_size etc.)
+        :return: a generator of Problems
+    """
+    with open(filename, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ValueError(filename + ': not an instance file')
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version = _HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version not in (1, VERSION):
+                raise ValueError(filename + ': not an instance file')
+            offset = _HEADER.size
+
+            while offset < len(data):
+                if version == 1:
+                    N, n_names, n_kinds = _INSTANCE_V1.unpack_from(data, offset)
+                    width = N
+                    offset += _INSTANCE_V1.size
+                else:
+                    N, width, n_names, n_kinds = _INSTANCE.unpack_from(data, offset)
+                    offset += _INSTANCE.size
+                names = []
+                for i in range(n_names):
+                    length = data[offset]
+                    names.append(data[offset+1:offset+1+length].decode('utf-8'))
+                    offset += 1 + length
+                blocks = {}
+                for i in range(n_kinds):
+                    blocks[names[i]] = _COUNT.unpack_from(data, offset)[0]
+                    offset += _COUNT.size
+                placed = _COUNT.unpack_from(data, offset)[0]
+                offset += _COUNT.size
+                initial = []
+                for i in range(placed):
+                    name, row, col = _PLACEMENT.unpack_from(data, offset)
+                    initial.append((names[name], row, col))
+                    offset += _PLACEMENT.size
+                blocked = []
+                if version > 1:
+                    count = _COUNT.unpack_from(data, offset)[0]
+                    offset += _COUNT.size
+                    for i in range(count):
+                        blocked.append(_CELL.unpack_from(data, offset))
+                        offset += _CELL.size
+                yield P.Problem(N, blocks, initial=initial, width=width, blocked=blocked,
+                                **options)
+
+
+def write_binary(filename, problems):
+    """ Write problems to a file in the binary format.
+        :param filename: path to the file
+        :param problems: any iterable of Problems
+    """
+    with open(filename, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, VERSION))
+        for theProblem in problems:
+            names = list(theProblem.blocks)
+            for (b, row, col) in theProblem.initial:
+                if b not in names:
+                    names.append(b)
+            file.write(_INSTANCE.pack(theProblem.N, theProblem.width, len(names),
+                                      len(theProblem.blocks)))
+            for b in names:
+                name = b.encode('utf-8')
+                file.write(bytes([len(name)]) + name)
+            for count in theProblem.blocks.values():
+                file.write(_COUNT.pack(count))
+            file.write(_COUNT.pack(len(theProblem.initial)))
+            for (b, row, col) in theProblem.initial:
+                file.write(_PLACEMENT.pack(names.index(b), row, col))
+            file.write(_COUNT.pack(len(theProblem.blocked)))
+            for (row, col) in theProblem.blocked:
+                file.write(_CELL.pack(row, col))
+
+
+def write_text(file, problems):
+    """ Write problems to an open text file in the text format.
+    """
+    for i, theProblem in enumerate(problems):
+        if i > 0:
+            file.write(SEPARATOR + '\n')
+        if theProblem.width == theProblem.N:
+            file.write('%d\n' % theProblem.N)
+        else:
+            file.write('%d %d\n' % (theProblem.N, theProblem.width))
+        for b, count in theProblem.blocks.items():
+            file.write('%s %d\n' % (b, count))
+        for (b, row, col) in theProblem.initial:
+            file.write('%s %d %d\n' % (b, row, col))
+        if theProblem.blocked:
+            blocked = set(theProblem.blocked)
+            for y in range(theProblem.N):
+                file.write(''.join(BLOCKED if (y, x) in blocked else OPEN
+                                   for x in range(theProblem.width)) + '\n')
+
+
+def read_file(filename, **options):
+    """ Read the instances in one file, text or binary.
+        :return: a generator of Problems
+    """
+    with open(filename, 'rb') as file:
+        binary = file.read(len(MAGIC)) == MAGIC
+    if binary:
+        yield from read_binary(filename, **options)
+    else:
+        with open(filename, 'r') as file:
+            yield from read_text(file, **options)
+
+
+def load(paths, **options):
+    """ Read every instance in some files and directories, one at a time.
+        :param paths: a path, or list of paths; a directory stands for the
+                      files in it, in name order
+        :param options: passed on to each Problem (cache_size etc.)
+        :return: a generator of (label, Problem).  The label is the file
+                 name for the first instance in a file, and 'name:k' for
+                 the k'th after that.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in paths:
+        if os.path.isdir(path):
+            filenames = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+            filenames = [f for f in filenames if os.path.isfile(f)]
+        else:
+            filenames = [path]
+        for filename in filenames:
+            for k, theProblem in enumerate(read_file(filename, **options)):
+                if k == 0:
+                    yield filename, theProblem
+                else:
+                    yield '%s:%d' % (filename, k), theProblem
@@ -0,0 +1,192 @@
+# CMPT 317: Counting and timing the hot paths of a search
+
+# While a Profiler is enabled, the State and Problem operations and the search
+# functions in localsearch.py are replaced by wrappers that count and time each
+# call.  Nothing is wrapped until enable() is called, and disable() puts the
+# originals back, so when profiling is off the code runs exactly as it always
+# does, at no cost.
+#
+# Besides the calls, it records how many States were allocated per step of
+# the search, and the best score over time (through the search's Budget).
+# The results can be saved as JSON, or as "folded stacks" (one line per call
+# path, with the microseconds spent in it), which flame graph tools such as
+# flamegraph.pl and speedscope read.
+#
+# Only calls made in this process are seen: restarts run by worker processes
+# (--workers) are counted as one call to parallel_random_restart.  The search
+# is assumed to run in one thread.
+#
+# Usage:
+#   import instrument
+#   profiler = instrument.Profiler()
+#   profiler.enable()
+#   budget = profiler.watch(localsearch.Budget())
+#   ... run a search with the budget ...
+#   profiler.disable()
+#   profiler.save('profile.json')      # or 'profile.folded'
+
+import functools
+import json
+import time
+import blockTiling as P
+import localsearch as search
+import exact
+
+
+# What gets wrapped: (owner, attribute names)
+TARGETS = [
+    (P.State, ['__init__', 'copy', 'legal_move', 'place_block', 'remove_block',
+               'get_score', 'legal_placements', 'apply_move', 'undo_move']),
+    (P.Problem, ['objective_function', 'random_state', 'moves', 'neighbors',
+                 'random_move', 'best_move', 'random_better_move', 'add_moves',
+                 'delta', 'random_step', 'best_step', 'random_better']),
+    (search, ['random_guessing', 'random_search', 'hillclimbing',
+              'stochastic_hillclimbing', 'first_improvement_hillclimbing',
+              'random_restart', 'parallel_random_restart',
+              'simulated_annealing', 'tabu_search']),
+    (exact, ['solve', 'repair']),
+]
+
+# The calls that make a new State
+ALLOCATIONS = ['State.__init__', 'State.copy']
+
+
+class Profiler(object):
+    """Call counts and times, and the progress of a search.
+    """
+
+    def __init__(self):
+        self.calls = {}         # label -> number of calls
+        self.seconds = {}       # label -> time spent in it, callees included
+        self.folded = {}        # "a;b;c" -> time spent in c itself, called that way
+        self.best = []          # (seconds, evaluations, score) at each improvement
+        self.budget = None
+
+        # the labels of the calls in progress, and the time spent so far
+        # in the callees of each
+        self.stack = []
+        self.inner = []
+
+        self.patched = []
+        self.start = None
+        self.elapsed = 0.0
+
+    def label(self, owner, name):
+        """ the name a call is recorded under: Class.method or module.function
+        """
+        return owner.__name__ + "." + name
+
+    def wrap(self, owner, name):
+        """ replace owner.name with a wrapper that records each call
+        """
+        original = getattr(owner, name)
+        label = self.label(owner, name)
+        calls, seconds, folded = self.calls, self.seconds, self.folded
+        stack, inner = self.stack, self.inner
+        calls[label] = 0
+        seconds[label] = 0.0
+
+        def wrapper(*args, **kwargs):
+            stack.append(label)
+            inner.append(0.0)
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                path = ";".join(stack)
+                stack.pop()
+                own = elapsed - inner.pop()
+                if inner:
+                    inner[-1] += elapsed
+                folded[path] = folded.get(path, 0.0) + own
+                calls[label] += 1
+                seconds[label] += elapsed
+
+        functools.update_wrapper(wrapper, original)
+        setattr(owner, name, wrapper)
+        self.patched.append((owner, name, original))
+
+    def enable(self):
+        """ Start recording.
+        """
+        if self.patched:
+            return
+        for owner, names in TARGETS:
+            for name in names:
+                self.wrap(owner, name)
+        self.start = time.perf_counter()
+
+    def disable(self):
+        """ Stop recording, and put the original functions back.
+        """
+        for owner, name, original in reversed(self.patched):
+            setattr(owner, name, original)
+        self.patched = []
+        if self.start is not None:
+            self.elapsed += time.perf_counter() - self.start
+            self.start = None
+
+    def watch(self, budget):
+        """ Record the best score over time from a localsearch.Budget.
+            :return: the budget
+        """
+        self.budget = budget
+        report = budget.on_improve
+        def on_improve(state):
+            if report is not None:
+                report(state)
+            self.best.append((time.perf_counter() - self.start, budget.evals,
+                              state.get_score()))
+        budget.on_improve = on_improve
+        return budget
+
+    def states(self):
+        """ the number of States allocated
+        """
+        return sum(self.calls.get(label, 0) for label in ALLOCATIONS)
+
+    def steps(self):
+        """ the number of evaluations the watched budget counted
+        """
+        if self.budget is None:
+            return 0
+        return self.budget.evals
+
+    def results(self):
+        """ everything recorded, as a dictionary
+        """
+        steps = self.steps()
+        return {'seconds': self.elapsed,
+                'calls': {label: {'count': self.calls[label], 'seconds': self.seconds[label]}
+                          for label in self.calls if self.calls[label] > 0},
+                'states': self.states(),
+                'steps': steps,
+                'states_per_step': self.states() / steps if steps else None,
+                'best': self.best}
+
+    def save(self, filename):
+        """ Write the results to a file: JSON if the name ends in .json,
+            otherwise folded stacks for a flame graph, in microseconds.
+        """
+        with open(filename, 'w') as file:
+            if filename.endswith('.json'):
+                json.dump(self.results(), file, indent=1)
+                return
+            for path, seconds in sorted(self.folded.items()):
+                micros = round(seconds * 1e6)
+                if micros > 0:
+                    file.write('%s %d\n' % (path, micros))
+
+    def report(self, top=15):
+        """ Print the calls that took the most time.
+        """
+        labels = sorted((l for l in self.calls if self.calls[l] > 0),
+                        key=lambda l: -self.seconds[l])
+        print('%-36s %10s %10s %12s' % ('call', 'count', 'secs', 'usec/call'))
+        for label in labels[:top]:
+            count, seconds = self.calls[label], self.seconds[label]
+            print('%-36s %10d %10.3f %12.2f' % (label, count, seconds, 1e6 * seconds / count))
+        steps = self.steps()
+        if steps:
+            print('States allocated per step: %.2f' % (self.states() / steps))
@@ -0,0 +1,179 @@
+# CMPT 317: Large neighbourhood search for the block tiling problem
+
+# One-block moves get stuck quickly: once nothing more fits, every single
+# remove makes things worse.  Large neighbourhood search takes a bigger step:
+# it picks a small window of the grid (4x4, say), takes out every block that
+# touches it (destroy), and then fills the cells that freed up as well as
+# they can be filled, with the exact solver (repair).  A repair never leaves
+# more cells empty than the blocks it replaced did (if it runs out of time
+# first, the old blocks go back), so the search moves sideways or down, but
+# it can rearrange several blocks at once.
+#
+# Several windows can be destroyed and repaired each step.  The windows are
+# chosen so that the cells they free up don't overlap, and the unused blocks
+# are shared out between them, so their repairs are independent of each other
+# and can run in a pool of worker processes side by side.
+#
+# Usage:
+#   import lns
+#   solution = lns.large_neighbourhood_search(theProblem, 500, size=4, windows=4,
+#                                             workers=4)
+
+import concurrent.futures
+import time
+import localsearch as search
+import exact
+
+
+def window_mask(board, row, col, size):
+    """ the bitboard of the cells of a size x size window at row, col,
+        clipped to the grid (blocked cells left out)
+    """
+    mask = 0
+    for y in range(row, min(row + size, board.N)):
+        for x in range(col, min(col + size, board.width)):
+            mask |= 1 << (y * board.stride + x)
+    return mask & board.inside
+
+
+def destroy(state, window):
+    """ Find the blocks of a State that touch a window.
+        :param state: a State
+        :param window: a bitboard of cells
+        :return: (removed, cells): the placements touching the window, and
+                 the window plus every cell those blocks cover
+    """
+    board = state.board
+    removed = []
+    cells = window
+    for (b, row, col) in state.used:
+        mask = board.placement(b, row, col)
+        if mask & window:
+            removed.append((b, row, col))
+            cells |= mask
+    return removed, cells
+
+
+def choose_windows(problem, state, size, windows):
+    """ Pick up to windows random windows whose destroyed cells don't overlap.
+        :return: a list of (removed, cells), as destroy() returns them
+    """
+    rng = problem.rng
+    board = state.board
+    rows = max(0, problem.N - size)
+    cols = max(0, problem.width - size)
+    chosen = []
+    taken = 0
+    for attempt in range(4 * windows):
+        if len(chosen) == windows:
+            break
+        window = window_mask(board, rng.randint(0, rows), rng.randint(0, cols), size)
+        removed, cells = destroy(state, window)
+        if cells & taken == 0:
+            chosen.append((removed, cells))
+            taken |= cells
+    return chosen
+
+
+def repair_all(problem, state, chosen, pool=None, deadline=None):
+    """ Destroy and repair some windows of a State.
+        :param chosen: the windows, from choose_windows()
+        :param pool: an optional process pool to repair the windows in
+        :param deadline: seconds each repair may take, or None
+        :return: the new State (state itself isn't changed)
+    """
+    after = state.copy()
+    for (removed, cells) in chosen:
+        for (b, row, col) in removed:
+            after.remove_block(b, row, col)
+
+    # each window gets back its own blocks, and a share of the blocks
+    # nobody was using
+    spare = dict(state.blocks)
+    starts = []
+    for i, (removed, cells) in enumerate(chosen):
+        allowance = {b: n // len(chosen) + (1 if i < n % len(chosen) else 0)
+                     for b, n in spare.items()}
+        for (b, row, col) in removed:
+            base = state.names[state.index[b]]
+            allowance[base] += 1
+        start = after.copy()
+        start.blocks = allowance
+        starts.append(start)
+
+    regions = [cells & ~after.bits for (removed, cells) in chosen]
+    if pool is None:
+        repairs = [exact.repair(problem, start, region, deadline)
+                   for start, region in zip(starts, regions)]
+    else:
+        repairs = list(pool.map(_repair_worker, starts, regions,
+                                [deadline] * len(chosen)))
+
+    for (removed, cells), region, (placements, empty) in zip(chosen, regions, repairs):
+        # a repair that ran out of time may have done worse than the
+        # blocks that were there; then put those back
+        before = region.bit_count() - sum(state.board.sizes[b] for (b, row, col) in removed)
+        if empty > before:
+            placements = removed
+        for (b, row, col) in placements:
+            after.place_block(b, row, col)
+    return after
+
+
+def _repair_worker(start, region, deadline):
+    """
+    One repair, run in a worker process (whose problem
+    localsearch._init_worker() set).
+    """
+    return exact.repair(search._worker_problem, start, region, deadline)
+
+
+def large_neighbourhood_search(problem, limit, size=4, windows=1, workers=1,
+                               deadline=1.0, budget=None, init=None):
+    """
+    Solve a problem by repeatedly destroying and repairing windows of the
+    grid.
+    :param problem: a blockTiling.Problem; it has to be picklable if
+                    workers is more than 1
+    :param limit: the number of steps
+    :param size: the width and height of a window
+    :param windows: the number of windows destroyed and repaired each step
+    :param workers: number of worker processes to repair windows in
+    :param deadline: seconds each repair may take; no repair runs past
+                     the budget's deadline
+    :param budget: an optional Budget
+    :param init: how to make the starting state (see
+                 localsearch.initial_state())
+    :return: the best state seen in the process
+    """
+    if budget is None:
+        budget = search.Budget()
+
+    current = search.initial_state(problem, init)
+    budget.spend()
+    budget.offer(current)
+
+    pool = None
+    if workers > 1 and windows > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                      initializer=search._init_worker,
+                                                      initargs=(problem,))
+    try:
+        count = 0
+        while count < limit and not budget.exhausted() and current.get_score() > 0:
+            chosen = choose_windows(problem, current, size, windows)
+            count += 1
+            budget.spend(len(chosen))
+            # a repair is never worse, so always move; equal scores let the
+            # search wander along plateaus
+            # a repair doesn't run past the budget's deadline
+            seconds = deadline
+            if budget.end is not None:
+                left = max(0.0, budget.end - time.perf_counter())
+                seconds = left if deadline is None else min(deadline, left)
+            current = repair_all(problem, current, chosen, pool, seconds)
+            budget.offer(current)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return current
@@ -16,17 +16,45 @@
 # 2. Random Search
 # 3. Hill-climbing
 # 4. Stochastic Hill climbing
+#    First-improvement Hill climbing
 # 5. Random-restart Hill-climbing
+# 6. Random-restart Hill-climbing, with the restarts spread over processes
+# 7. Simulated annealing
+# 8. Tabu search
 
 # The search algorithms assume a Problem class with the methods:
 #   random_state():
 #       returns a completely random state
+#   greedy_state(rule):
+#       returns a state built greedily (only if asked for with init=)
 #   random_step(state): 
 #       returns a neighbour one step away from the given state at random
 #   best_step(state): 
 #       returns the best neighbour one step away from the given state
 #   random_better(state): 
 #       returns a randomly chosen better neighbour of state
+#   neighbors(state):
+#       returns a list of all the neighbours of state (tabu search only)
+#   iter_neighbors(state):
+#       generates the neighbours of state one at a time, in a random order
+#       (first-improvement hill climbing only)
+#   objective_function(state):
+#       returns the score of state; smaller is better (simulated annealing only)
+#
+# A Problem may also offer moves, which let the search change one State in
+# place instead of building a new State for every neighbour:
+#   random_move(state), best_move(state), random_better_move(state):
+#       like the step methods above, but return a move instead of a State
+#       (best_move returns the pair (move, delta))
+#   delta(state, move):
+#       the change in the objective that move would make; negative is better
+#   iter_moves(state):
+#       like iter_neighbors(), but generates moves
+# and the State then has to respond to apply_move(move) and undo_move(move).
+#
+# If the Problem has an attribute rng (a random.Random), the searches draw
+# their own random numbers from it too, so that a run depends only on how the
+# problem was seeded; otherwise they use the random module.
 
 # The Local Search strategies also assume that a State class exists with the following methods:
 #   is_better_than(self, other)
@@ -42,34 +70,302 @@
 #   pi = <create a problem instance according to the Problem class>
 #   solution = Search.random_guessing(theProblem, 1000) 
 #   #  solution is a State object
+#
+# Every search also takes an optional Budget, which can stop it early on a
+# deadline or after a number of evaluations, and report each improvement:
+#   budget = Search.Budget(deadline=0.2, on_improve=print)
+#   solution = Search.hillclimbing(theProblem, 1000, budget)
+# or, to get the improvements as a stream:
+#   for s in Search.anytime(Search.hillclimbing, theProblem, 1000):
+#       ...
+
+import collections
+import concurrent.futures
+import copy
+import math
+import os
+import pickle
+import queue
+import random
+import threading
+import time
+
+
+class Budget(object):
+    """
+    Limits on a search besides its step count, and a record of the best
+    state it has found so far.  Checking a budget is cheap enough to do
+    once per step.
+
+    An evaluation is one call that asks the problem for a state or a
+    move: random_state(), random_step(), best_step(), and so on.
+    """
+
+    def __init__(self, deadline=None, max_evals=None, on_improve=None):
+        """
+        :param deadline: number of seconds, from now, that the search may run
+        :param max_evals: number of evaluations the search may make
+        :param on_improve: function called with a copy of each state that
+                           is better than every state before it
+        """
+        if deadline is None:
+            self.end = None
+        else:
+            self.end = time.perf_counter() + deadline
+        self.max_evals = max_evals
+        self.on_improve = on_improve
+        self.evals = 0
+        self.stopped = False
+        self.best = None
+
+    def spend(self, evals=1):
+        """
+        Count evaluations against the budget.
+        """
+        self.evals += evals
+
+    def exhausted(self):
+        """
+        True if the search should stop now.
+        """
+        if self.stopped:
+            return True
+        if self.max_evals is not None and self.evals >= self.max_evals:
+            return True
+        return self.end is not None and time.perf_counter() >= self.end
+
+    def stop(self):
+        """
+        Make the budget run out, e.g. from another thread.
+        """
+        self.stopped = True
+
+    def offer(self, state):
+        """
+        Tell the budget about the current state of a search.  If it is the
+        best so far, a copy of it is kept and passed to on_improve.
+        """
+        if self.best is None or state.is_better_than(self.best):
+            # the search may go on to change the state in place
+            if hasattr(state, 'copy'):
+                state = state.copy()
+            self.best = state
+            if self.on_improve is not None:
+                self.on_improve(state)
+
+    def child(self, max_evals=None):
+        """
+        A budget with the same deadline and the evaluations left, for a
+        search run somewhere else (e.g. in another process).  It does not
+        report improvements.  It is a copy of this one, so whatever else a
+        subclass checks (e.g. service.CancellableBudget's cancel flag)
+        still stops it.
+        :param max_evals: a smaller share of the evaluations left, for
+                          searches that run side by side
+        """
+        b = copy.copy(self)
+        b.on_improve = None
+        b.evals = 0
+        b.best = None
+        if self.max_evals is not None:
+            b.max_evals = self.max_evals - self.evals
+            if max_evals is not None:
+                b.max_evals = min(b.max_evals, max_evals)
+        return b
+
+    def shares(self, n):
+        """
+        n child() budgets that split the evaluations left between them as
+        evenly as they can, for n searches that run side by side.  (If
+        fewer evaluations than n are left, some get none.)
+        """
+        if self.max_evals is None:
+            return [self.child() for i in range(n)]
+        share, extra = divmod(max(0, self.max_evals - self.evals), n)
+        return [self.child(share + (i < extra)) for i in range(n)]
+
+
+def anytime(search, problem, *args, budget=None, **kwargs):
+    """
+    Run a search in a background thread, yielding each improved state as
+    soon as it is found.  Closing the generator stops the search.
+    :param search: one of the search functions in this module
+    :param problem: the problem to pass to it
+    :param args, kwargs: any other arguments for it
+    :param budget: an optional Budget
+    """
+    if budget is None:
+        budget = Budget()
+    found = queue.Queue()
+    done = object()
+    errors = []
+
+    report = budget.on_improve
+    def on_improve(state):
+        if report is not None:
+            report(state)
+        found.put(state)
+    budget.on_improve = on_improve
+
+    def run():
+        try:
+            search(problem, *args, budget=budget, **kwargs)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            found.put(done)
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    try:
+        while True:
+            state = found.get()
+            if state is done:
+                break
+            yield state
+    finally:
+        budget.stop()
+        worker.join()
+    if errors:
+        raise errors[0]
+
+
+class Checkpoint(object):
+    """
+    A file where a long search saves its progress now and then, so that it
+    can carry on from there if it is interrupted.  The progress is a
+    dictionary that depends on the search (random_restart() and
+    parallel_random_restart() know how to use one); its best state is
+    stored with the state's to_bytes() if it has one.
+
+    The file is replaced in one step, so an interruption while saving
+    leaves the previous checkpoint as it was.
+    """
+
+    def __init__(self, path, every=60.0, key=None):
+        """
+        :param path: the file to save to and resume from
+        :param every: the least number of seconds between saves
+        :param key: anything identifying the run (problem, settings); a
+                    checkpoint saved with a different key is not resumed
+        """
+        self.path = path
+        self.every = every
+        self.key = key
+        self.last = time.perf_counter()
+
+    def load(self, problem):
+        """
+        The progress saved in the file, or None if there isn't any.
+        :raise ValueError: if it was saved by a different run
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as file:
+            progress = pickle.load(file)
+        if progress.pop('key') != self.key:
+            raise ValueError(self.path + ' is a checkpoint of a different run')
+        best = progress['best']
+        if isinstance(best, bytes) and hasattr(problem, 'state_from_bytes'):
+            progress['best'] = problem.state_from_bytes(best)
+        return progress
+
+    def save(self, force=False, **progress):
+        """
+        Save progress, if the last save was long enough ago.
+        :param force: save now, however recent the last save was
+        """
+        now = time.perf_counter()
+        if not force and now - self.last < self.every:
+            return
+        best = progress['best']
+        if hasattr(best, 'to_bytes'):
+            progress['best'] = best.to_bytes()
+        progress['key'] = self.key
+        partial = self.path + '.partial'
+        with open(partial, 'wb') as file:
+            pickle.dump(progress, file)
+        os.replace(partial, self.path)
+        self.last = now
+
+
+def rng(problem):
+    """
+    The random number generator to use for a problem: its own, if it has
+    one, or else the random module.
+    """
+    return getattr(problem, "rng", random)
+
+
+def initial_state(problem, init=None):
+    """
+    The state a search starts from: a random one, or, if init names a rule
+    ('bottom-left' or 'constrained'), one the problem builds greedily with
+    greedy_state(init).  init can also be a state to start from (e.g. the
+    best one found by an earlier run); the search gets a copy of it.
+    """
+    if init is None:
+        return problem.random_state()
+    if not isinstance(init, str):
+        return init.copy()
+    if init == 'random':
+        return problem.random_state()
+    return problem.greedy_state(init)
+
+
+def restart_init(init, k):
+    """
+    How the k'th of several starts (restarts, members of a population)
+    is made: as init says, except that a state given as init is only the
+    first start.  The rest start randomly, or they would all be the same.
+    """
+    if k > 0 and init is not None and not isinstance(init, str):
+        return None
+    return init
+
 
-def random_guessing(problem, limit):
+def uses_moves(problem):
+    """
+    True if the problem offers the move interface described above.
+    """
+    return hasattr(problem, 'best_move')
+
+
+def random_guessing(problem, limit, budget=None, init=None):
     """
     Solve the problem by proposing random states, always keeping the
     best state seen so far.
     :param problem: an instance of a class that responds to random_state() and is_better_than()
     :param limit: the number of proposals to try
+    :param budget: an optional Budget
+    :param init: how to make the starting state (see initial_state())
     :return: the best of the states proposed, as judged by is_better_than()
     """
+    if budget is None:
+        budget = Budget()
 
     count = 0
     # grab a random state to start with
-    best_guess = problem.random_state()
+    best_guess = initial_state(problem, init)
+    budget.spend()
+    budget.offer(best_guess)
     
-    while count < limit:
+    while count < limit and not budget.exhausted():
         # propose a new random state
         guess = problem.random_state()
         count += 1
+        budget.spend()
 
         # remember if it's better
         if guess.is_better_than(best_guess):
             best_guess = guess
+            budget.offer(best_guess)
 
     # return the best one
     return best_guess
 
 
-def random_search(problem, limit):
+def random_search(problem, limit, budget=None, init=None):
     """
     Solve the problem by making a random change to the current state.
     Keep it if it the random change is better.
@@ -77,45 +373,105 @@ def random_search(problem, limit):
     :param problem: an instance of a class that responds to
                     random_state() is_better_than()  random_step()
     :param limit:  The number of times to try a random change
+    :param budget: an optional Budget
+    :param init: how to make the starting state (see initial_state())
     :return: the best state seen during the process
     """
+    if budget is None:
+        budget = Budget()
 
     count = 0
     # grab a random state to start with
-    best_guess = problem.random_state()
+    best_guess = initial_state(problem, init)
+    budget.spend()
+    budget.offer(best_guess)
     
-    while count < limit:
+    moves = uses_moves(problem)
+
+    while count < limit and not budget.exhausted():
+        if moves:
+            # look at a random change, and only make it if it helps
+            move = problem.random_move(best_guess)
+            count += 1
+            budget.spend()
+            if move is not None and problem.delta(best_guess, move) < 0:
+                best_guess.apply_move(move)
+                budget.offer(best_guess)
+            continue
+
         # ask for a random change to the current state
         guess = problem.random_step(best_guess)
         count += 1
+        budget.spend()
 
         # keep it if it is better
         if guess.is_better_than(best_guess):
             best_guess = guess
+            budget.offer(best_guess)
 
     # return the best one
     return best_guess
 
 
-def hillclimbing(problem, limit):
+def joined(seen, state):
+    """
+    True if an earlier climb passed through state itself (seen holds their
+    zobrist_key()s); if not, note that this one has.  Only exact revisits
+    count: from a rotation or reflection of a state, best_step() needn't
+    go the mirror-image way.
+    """
+    key = zobrist_key(state)
+    if key in seen:
+        return True
+    seen.add(key)
+    return False
+
+
+def hillclimbing(problem, limit, budget=None, init=None, seen=None):
     """
     Solve a problem by taking the biggest uphill step at every state.
     Stop when there are no uphill steps, or you reached the limit.
     :param problem: an instance of a class that responds to
                     random_state() is_better_than() is_equal_to() best_step()
     :param limit: maximum number of uphill steps to try
+    :param budget: an optional Budget
+    :param init: how to make the starting state (see initial_state())
+    :param seen: an optional set shared by several climbs (see joined());
+                 a climb stops where it reaches a state an earlier one
+                 passed through, since the steps are chosen the same way
+                 from there on
     :return: the best state seen in the process
     """
+    if budget is None:
+        budget = Budget()
 
     count = 0
 
     # grab a random state to start with
-    best_guess = problem.random_state()
+    best_guess = initial_state(problem, init)
+    budget.spend()
+    budget.offer(best_guess)
+    moves = uses_moves(problem)
+
+    while count < limit and not budget.exhausted():
+        if seen is not None and joined(seen, best_guess):
+            return best_guess
+        if moves:
+            # ask for the best move, and make it only if it is uphill
+            move, delta = problem.best_move(best_guess)
+            count += 1
+            budget.spend()
+            # local maximum or plateau
+            if move is None or delta >= 0:
+                return best_guess
+            best_guess.apply_move(move)
+            budget.offer(best_guess)
+            continue
 
-    while count < limit:
         # ask for the best state one step away from the current state
         best_neighbour = problem.best_step(best_guess)
         count += 1
+        budget.spend()
 
         # if the best step is worse than the current state, stop looking (local maximum)
         if best_guess.is_better_than(best_neighbour):
@@ -126,30 +482,50 @@ def hillclimbing(problem, limit):
         # if the best step is uphill, remember it
         else:
             best_guess = best_neighbour
+            budget.offer(best_guess)
 
     # return the best one
     return best_guess
 
 
-def stochastic_hillclimbing(problem, limit):
+def stochastic_hillclimbing(problem, limit, budget=None, init=None):
     """
     Solve a problem by taking a random uphill step at every state.
     Stop when there are no uphill steps, or you reached the limit.
     :param problem: an instance of a class that responds to
                     random_state() is_better_than()  random_better()
     :param limit: maximum number of uphill steps to try
+    :param budget: an optional Budget
+    :param init: how to make the starting state (see initial_state())
     :return: the best state seen in the process
     """
+    if budget is None:
+        budget = Budget()
 
     count = 0
 
     # grab a random state to start with
-    best_guess = problem.random_state()
+    best_guess = initial_state(problem, init)
+    budget.spend()
+    budget.offer(best_guess)
+    moves = uses_moves(problem)
+
+    while count < limit and not budget.exhausted():
+        if moves:
+            # ask for a move that's better, chosen at random from the better moves
+            move = problem.random_better_move(best_guess)
+            count += 1
+            budget.spend()
+            if move is None:
+                return best_guess
+            best_guess.apply_move(move)
+            budget.offer(best_guess)
+            continue
 
-    while count < limit:
         # ask for a state that's better, chosen at random from the better states
         selection = problem.random_better(best_guess)
         count += 1
+        budget.spend()
 
         # if a better state could not be found, stop looking
         if selection is None:
@@ -157,36 +533,456 @@ def stochastic_hillclimbing(problem, limit):
         else:
             # remember the better one
             best_guess = selection
+            budget.offer(best_guess)
+
+    # return the best one
+    return best_guess
+
+
+def first_improvement_hillclimbing(problem, limit, budget=None, init=None):
+    """
+    Solve a problem by taking the first uphill step found at every state,
+    looking at the neighbours in a random order.  Each step only costs as
+    much as finding one better neighbour, rather than looking at them all.
+    Stop when there are no uphill steps, or you reached the limit.
+    :param problem: an instance of a class that responds to
+                    random_state() is_better_than() iter_neighbors(), or
+                    iter_moves() and delta() for the move interface
+    :param limit: maximum number of uphill steps to try
+    :param budget: an optional Budget
+    :param init: how to make the starting state (see initial_state())
+    :return: the best state seen in the process
+    """
+    if budget is None:
+        budget = Budget()
+
+    count = 0
+
+    # grab a random state to start with
+    best_guess = initial_state(problem, init)
+    budget.spend()
+    budget.offer(best_guess)
+    moves = uses_moves(problem)
+
+    while count < limit and not budget.exhausted():
+        count += 1
+        budget.spend()
+        if moves:
+            # make the first move that helps
+            for move in problem.iter_moves(best_guess):
+                if problem.delta(best_guess, move) < 0:
+                    break
+            else:
+                # local maximum or plateau
+                return best_guess
+            best_guess.apply_move(move)
+        else:
+            for neighbour in problem.iter_neighbors(best_guess):
+                if neighbour.is_better_than(best_guess):
+                    break
+            else:
+                return best_guess
+            best_guess = neighbour
+        budget.offer(best_guess)
 
     # return the best one
     return best_guess
 
 
-def random_restart(problem, rstarts=10, limit=10, stochastic=False):
+def random_restart(problem, rstarts=10, limit=10, stochastic=False, budget=None,
+                   checkpoint=None, init=None):
     """
     Repeat hill-climbing by starting at several random locations.
+
+    If the problem has symmetry turned on, the (non-stochastic) climbs
+    share the keys of the states they pass through, and a climb that
+    reaches a state an earlier one passed through stops there (see
+    joined()).
     :param problem: an instance of a class that responds to
                     random_state() is_better_than()  best_step()
     :param rstarts: the number of times to start again from a random point
     :param limit: maximum number of uphill steps to try with each restart
+    :param budget: an optional Budget, shared by all the restarts
+    :param checkpoint: an optional Checkpoint; the search carries on from
+                       the progress saved in it, and saves its own after
+                       each restart (the best state, the restart number,
+                       the evaluations spent and the problem's random
+                       number state)
+    :param init: how to make the starting state (see restart_init())
     :return: the best state seen in the process
     """
+    if budget is None:
+        budget = Budget()
+
+    # the states climbed through so far, if mirror images are the same
+    seen = None
+    if getattr(problem, 'symmetry', False) and not stochastic:
+        seen = set()
+
+    best_guess = None
+    start = 0
+    if checkpoint is not None:
+        progress = checkpoint.load(problem)
+        if progress is not None:
+            best_guess = progress['best']
+            start = progress['restart']
+            rng(problem).setstate(progress['rng'])
+            budget.spend(progress['evals'])
+            budget.offer(best_guess)
+
+    def save(force):
+        checkpoint.save(force, best=best_guess, restart=done,
+                        rng=state, evals=evals)
+
+    # the progress after the last restart to finish
+    done, state, evals = start, rng(problem).getstate(), budget.evals
+    try:
+        for r in range(start, rstarts + 1):
+            if r > 0 and budget.exhausted():
+                break
+            # try again, maybe it's better?
+            if stochastic:
+                g = stochastic_hillclimbing(problem, limit, budget, restart_init(init, r))
+            else:
+                g = hillclimbing(problem, limit, budget, restart_init(init, r), seen)
+
+            # if it's better, remember it
+            if best_guess is None or g.is_better_than(best_guess):
+                best_guess = g
+
+            done, state, evals = r + 1, rng(problem).getstate(), budget.evals
+            if checkpoint is not None:
+                save(False)
+    finally:
+        # including when interrupted part way through a restart
+        if checkpoint is not None and best_guess is not None:
+            save(True)
+
+    # return the best one
+    return best_guess
+
+
+# The problem a worker process is solving, set once per worker by
+# _init_worker() so that it isn't pickled again for every restart.  The
+# worker pools of evolution.py and lns.py use these too.
+_worker_problem = None
 
-    # do hill-climbing the first time,
+
+def _init_worker(problem):
+    global _worker_problem
+    _worker_problem = problem
+
+
+def _restart_worker(limit, stochastic, seed, budget, init):
+    """
+    One restart of parallel_random_restart(), run in a worker process.
+    :return: the state it climbed to, the evaluations it spent, and whether
+             it started before the budget ran out
+    """
+    ran = not budget.exhausted()
+    rng(_worker_problem).seed(seed)
     if stochastic:
-        do_HC = stochastic_hillclimbing
+        g = stochastic_hillclimbing(_worker_problem, limit, budget, init)
     else:
-        do_HC = hillclimbing
-    
-    best_guess = do_HC(problem, limit)
+        g = hillclimbing(_worker_problem, limit, budget, init)
+    return g, budget.evals, ran
+
+
+def parallel_random_restart(problem, rstarts=10, limit=10, stochastic=False,
+                            workers=None, seed=None, budget=None, checkpoint=None, init=None):
+    """
+    Random-restart hill-climbing with the restarts run in a pool of
+    worker processes.  Like random_restart(), it does rstarts+1 climbs.
+
+    Restart i seeds the problem's rng (see rng()) with seed+i, so a given
+    seed always gives the same answer however many workers there are: the
+    best state, with ties going to the lowest restart.  As soon as a
+    restart finds a perfect score (0), the later restarts are cancelled.
+
+    Restarts are handed to the workers a few at a time, each with what is
+    left of the budget, and the evaluations they spend are counted against
+    it.  Once the budget runs out no more are started, and any that are
+    queued are cancelled; a deadline or evaluation limit makes the answer
+    depend on timing.  Unlike random_restart(), the climbs don't stop where
+    they meet each other's paths, as that would depend on which worker ran
+    what.
+
+    :param problem: an instance of a class that responds to
+                    random_state() is_better_than()  best_step(); it
+                    has to be picklable
+    :param rstarts: the number of times to start again from a random point
+    :param limit: maximum number of uphill steps to try with each restart
+    :param workers: number of worker processes (default: one per CPU)
+    :param seed: base seed for the restarts (default: a random one)
+    :param budget: an optional Budget
+    :param checkpoint: an optional Checkpoint; the search carries on from
+                       the progress saved in it, and saves its own as
+                       restarts finish (the seed, how many restarts in a
+                       row have finished, and the best state among them)
+    :param init: how to make the starting state (see restart_init())
+    :return: the best state seen in the process
+    """
+    if budget is None:
+        budget = Budget()
+    if seed is None:
+        seed = rng(problem).randrange(2**32)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    results = {}
+    # the last restart whose result can still matter
+    stop_at = rstarts
+
+    # restarts 0 .. start-1 are done, and the best of them stands in for
+    # them all as restart start-1 (it wins ties against later ones anyway)
+    start = 0
+    if checkpoint is not None:
+        progress = checkpoint.load(problem)
+        if progress is not None:
+            seed = progress['seed']
+            start = progress['restart']
+            results[start - 1] = progress['best']
+            budget.spend(progress['evals'])
+            budget.offer(progress['best'])
+            if progress['best'].get_score() == 0:
+                stop_at = start - 1
+
+    def save(force):
+        checkpoint.save(force, best=prefix, restart=done, seed=seed, evals=budget.evals)
+
+    # the restarts finished in a row from the start, and the best of them
+    done, prefix = start, results.get(start - 1)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    initializer=_init_worker,
+                                                    initargs=(problem,)) as pool:
+            # restart -> future of the restarts handed out and not yet
+            # finished, and the evaluations each of them may spend, and
+            # the next restart to hand out
+            running = {}
+            allowed = {}
+            r = start
+            while True:
+                # keep each worker busy with one restart, and one more
+                # queued, while the budget lasts; the evaluations left are
+                # shared out, so the restarts in flight can't spend more
+                # between them
+                while (r <= stop_at and len(running) < 2 * workers
+                       and (r == 0 or not budget.exhausted())):
+                    allowance = None
+                    if budget.max_evals is not None:
+                        left = budget.max_evals - budget.evals - sum(allowed.values())
+                        if left <= 0 and r > 0:
+                            break
+                        allowance = max(1, left // (2 * workers - len(running)))
+                    running[r] = pool.submit(_restart_worker, limit, stochastic, seed + r,
+                                             budget.child(allowance), restart_init(init, r))
+                    allowed[r] = allowance or 0
+                    r += 1
+                if not running:
+                    break
+
+                # wake up at the deadline, if there is one, to stop
+                # handing out restarts
+                timeout = None
+                if budget.end is not None and not budget.exhausted():
+                    timeout = max(0.0, budget.end - time.perf_counter())
+                finished, pending = concurrent.futures.wait(
+                    running.values(), timeout, concurrent.futures.FIRST_COMPLETED)
+
+                for q in sorted(q for q, f in running.items() if f in finished):
+                    g, evals, ran = running.pop(q).result()
+                    del allowed[q]
+                    budget.spend(evals)
+                    # a restart that only started once the budget had run
+                    # out didn't really run (it isn't done, as far as a
+                    # checkpoint goes); the first one counts regardless,
+                    # as in random_restart()
+                    if q > stop_at or not (ran or q == 0):
+                        continue
+                    results[q] = g
+                    budget.offer(g)
+                    if g.get_score() == 0 and q < stop_at:
+                        stop_at = q
+                while done in results and done <= stop_at:
+                    if prefix is None or results[done].is_better_than(prefix):
+                        prefix = results[done]
+                    done += 1
+                if checkpoint is not None:
+                    save(False)
+
+                # drop the restarts that are no longer needed, or that the
+                # budget can't pay for, if they haven't started yet
+                for q, f in list(running.items()):
+                    if (q > stop_at or budget.exhausted()) and f.cancel():
+                        del running[q]
+                        del allowed[q]
+    finally:
+        if checkpoint is not None and prefix is not None:
+            save(True)
+
+    # keep the lowest-numbered restart among the best ones
+    best_guess = None
+    for r in sorted(results):
+        if r <= stop_at and (best_guess is None or results[r].is_better_than(best_guess)):
+            best_guess = results[r]
+
+    # return the best one
+    return best_guess
+
+
+# Cooling schedules for simulated annealing.  Each one returns a function
+# that gives the temperature at step k; a temperature of 0 ends the search.
+
+def geometric_cooling(t0=2.0, alpha=0.995):
+    """
+    T(k) = t0 * alpha**k
+    """
+    return lambda k: t0 * alpha ** k
+
+
+def linear_cooling(t0=2.0, steps=1000):
+    """
+    T(k) falls in a straight line from t0 to 0 over the given number of steps.
+    """
+    return lambda k: max(0.0, t0 * (1 - k / steps))
+
 
-    for r in range(rstarts):
-        # try again, maybe it's better?
-        g = do_HC(problem, limit)
+def logarithmic_cooling(t0=2.0):
+    """
+    T(k) = t0 / log(k + 2); slow, but the classic schedule.
+    """
+    return lambda k: t0 / math.log(k + 2)
+
+
+def simulated_annealing(problem, limit, schedule=None, budget=None, init=None):
+    """
+    Solve a problem by taking random steps, always accepting uphill steps
+    and accepting downhill steps with a probability that shrinks as the
+    temperature falls.  Unlike hill-climbing, it does not stop on a plateau.
+    :param problem: an instance of a class that responds to
+                    random_state() random_step() objective_function()
+    :param limit: maximum number of steps to try
+    :param schedule: cooling schedule, a function from the step number to
+                     the temperature (default: geometric_cooling())
+    :param budget: an optional Budget
+    :param init: how to make the starting state (see initial_state())
+    :return: the best state seen in the process
+    """
+    if schedule is None:
+        schedule = geometric_cooling()
+    if budget is None:
+        budget = Budget()
+
+    count = 0
+    current = initial_state(problem, init)
+    budget.spend()
+    budget.offer(current)
+    current_score = problem.objective_function(current)
+    best_guess = current
+
+    while count < limit and not budget.exhausted():
+        temperature = schedule(count)
+        if temperature <= 0:
+            break
+
+        # propose a random change, and decide whether to take it
+        guess = problem.random_step(current)
+        count += 1
+        budget.spend()
+        d = problem.objective_function(guess) - current_score
+        if d <= 0 or rng(problem).random() < math.exp(-d / temperature):
+            current = guess
+            current_score += d
+            # remember if it's the best so far
+            if current.is_better_than(best_guess):
+                best_guess = current
+                budget.offer(best_guess)
+
+    # return the best one
+    return best_guess
 
-        # if it's better, remember it
-        if g.is_better_than(best_guess):
-            best_guess = g
+
+def zobrist_key(state):
+    """
+    A state's full Zobrist key (its zkey), or its hash if it has none.
+    hash() is no use for telling which placement changed: Python cuts a
+    __hash__ down to the width of its own hashes, which breaks the XOR.
+    """
+    key = getattr(state, 'zkey', None)
+    if key is None:
+        return hash(state)
+    return key
+
+
+def tabu_search(problem, limit, tenure=10, budget=None, init=None):
+    """
+    Solve a problem by always taking the best step that is not tabu, even
+    if it is downhill.  A step that adds or removes a block placement that
+    was added or removed in the last few steps is tabu, unless it leads to
+    the best state seen so far.
+    :param problem: an instance of a class that responds to
+                    random_state() neighbors() is_better_than(), with
+                    Zobrist-keyed states (see zobrist_key())
+    :param limit: maximum number of steps to try
+    :param tenure: how many steps a placement stays tabu
+    :param budget: an optional Budget
+    :param init: how to make the starting state (see initial_state())
+    :return: the best state seen in the process
+    """
+    if budget is None:
+        budget = Budget()
+
+    count = 0
+    current = initial_state(problem, init)
+    budget.spend()
+    budget.offer(current)
+    best_guess = current
+
+    # the recently changed placements, oldest first, as (step, key), and
+    # the step at which each key was last made tabu, for fast lookups
+    recent = collections.deque()
+    tabu = {}
+
+    while count < limit and not budget.exhausted():
+        count += 1
+        budget.spend()
+
+        current_key = zobrist_key(current)
+        choice, choice_key = None, None
+        oldest, oldest_key = None, None
+        for n in problem.neighbors(current):
+            # with Zobrist hashing, the XOR of the two keys is the key
+            # of the placement this step adds or removes
+            key = current_key ^ zobrist_key(n)
+            if key in tabu and not n.is_better_than(best_guess):
+                # keep the step that has been tabu longest, in case
+                # every step is
+                if oldest is None or tabu[key] < tabu[oldest_key]:
+                    oldest, oldest_key = n, key
+                continue
+            if choice is None or n.is_better_than(choice):
+                choice, choice_key = n, key
+
+        # every step is tabu: take the one that has been tabu longest
+        if choice is None:
+            if oldest is None:
+                break
+            choice, choice_key = oldest, oldest_key
+
+        current = choice
+        recent.append((count, choice_key))
+        tabu[choice_key] = count
+        if len(recent) > tenure:
+            step, key = recent.popleft()
+            # unless it has been made tabu again since
+            if tabu.get(key) == step:
+                del tabu[key]
+
+        # remember if it's the best so far
+        if current.is_better_than(best_guess):
+            best_guess = current
+            budget.offer(best_guess)
 
     # return the best one
     return best_guess
@@ -1,5 +1,8 @@
 #! /usr/bin/bash
 
+# The same sweep in one process pool, with the results saved as CSV:
+#   python solver.py --batch ../Data/tiles1.txt ../Data/tiles2.txt ../Data/tiles3.txt --out results.csv
+
 python solver.py ../Data/tiles1.txt RG 200
 python solver.py ../Data/tiles1.txt RG 1000
 python solver.py ../Data/tiles1.txt RG 5000
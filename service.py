@@ -0,0 +1,381 @@
+# CMPT 317: A solve service for the block tiling problem
+
+# SolveService is an asyncio front end to the searches in solver.py.  Each
+# request names an instance (grid size and blocks), an algorithm and a budget;
+# the search itself runs in a pool of worker processes that is started once,
+# so a burst of requests queues up for the workers instead of starting an
+# interpreter each.
+#
+#  - Identical requests that arrive while one is already running wait for the
+#    same search instead of starting another.
+#  - Finished results are kept, by instance fingerprint and search settings,
+#    and handed straight back when the same request comes again.
+#  - A search is cancelled when every request waiting on it is cancelled, or
+#    when cancel() is called with the same request.  The worker notices at its
+#    next step and stops with the best state so far; a cancelled result is not
+#    cached.  (The exact solver, EX, only stops at its deadline: the
+#    request's seconds, or solver.EX_DEADLINE.)
+#
+# serve() puts the service behind a small HTTP server, on a TCP port or a Unix
+# socket.  It takes JSON bodies:
+#   POST /solve   {"N": 12, "blocks": {"+": 7, "L": 6}, "algorithm": "HC",
+#                  "steps": 1000, "seconds": 5, "max_evals": null, "seed": 0}
+#                 and optionally "width": 16 for a grid that isn't square,
+#                 "blocked": [[row, col], ...] for cells that can't be covered
+#                 answers {"score", "placements", "seconds", "fingerprint",
+#                          "cancelled", "cached"}
+#   POST /cancel  the same body as the /solve to cancel
+#   GET  /stats   request counts
+# A bad request gets status 400 and {"error": message}.
+#
+# Usage:
+#   python service.py --port 8317 [--workers 4]
+#   python service.py --unix /tmp/tiler.sock
+# or from asyncio code:
+#   service = SolveService(workers=4)
+#   result = await service.solve(12, {"+": 7, "L": 6}, "SA", steps=5000)
+#   service.close()
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import time
+import blockTiling as P
+import localsearch as search
+import solver
+
+
+# The most searches that can be running or queued at once
+MAX_IN_FLIGHT = 1024
+
+# The most cells a requested grid may have (N * width).  A Board keeps a
+# bitboard the size of the grid for every placement, so memory grows with
+# the square of this.
+MAX_CELLS = 150 * 150
+
+# The cancel flags of the searches, one per slot, shared with the worker
+# processes; set once per worker by _init_worker().
+_cancel_flags = None
+
+
+def _init_worker(flags):
+    global _cancel_flags
+    _cancel_flags = flags
+
+
+class CancellableBudget(search.Budget):
+    """A Budget that also runs out when the service cancels its search.
+    """
+
+    def __init__(self, flags, slot, deadline=None, max_evals=None):
+        """
+        :param flags: the shared cancel flags
+        :param slot: which of them belongs to this search
+        """
+        search.Budget.__init__(self, deadline, max_evals)
+        self.flags = flags
+        self.slot = slot
+
+    def exhausted(self):
+        if self.flags[self.slot]:
+            self.stopped = True
+        return search.Budget.exhausted(self)
+
+
+def run_search(request, slot):
+    """ Run one search in a worker process.
+        :param request: a request dictionary, as validate() returns it
+        :param slot: the search's cancel flag
+        :return: the result dictionary
+    """
+    theProblem = make_problem(request)
+    budget = CancellableBudget(_cancel_flags, slot, request['seconds'], request['max_evals'])
+    start = time.perf_counter()
+    solution = solver.solve(theProblem, request['algorithm'], request['steps'],
+                            seed=request['seed'], budget=budget)
+    end = time.perf_counter()
+    return {'score': solution.get_score(), 'placements': solution.used,
+            'seconds': end - start, 'fingerprint': theProblem.fingerprint(),
+            'cancelled': bool(_cancel_flags[slot])}
+
+
+def make_problem(request):
+    """ the Problem a request (as validate() returns it) is about
+    """
+    return P.Problem(request['N'], request['blocks'], width=request['width'],
+                     blocked=[tuple(cell) for cell in request['blocked']])
+
+
+def _is_int(x):
+    # JSON true and false come through as bools, which are ints in Python
+    return isinstance(x, int) and not isinstance(x, bool)
+
+
+def validate(request):
+    """ Check a request and fill in its defaults.
+        :param request: a dictionary with at least N and blocks
+        :return: a new dictionary with every field
+        :raise ValueError: if something is missing or wrong
+    """
+    if not isinstance(request, dict):
+        raise ValueError('a request is a JSON object')
+    unknown = set(request) - {'N', 'width', 'blocked', 'blocks', 'algorithm', 'steps',
+                              'seconds', 'max_evals', 'seed'}
+    if unknown:
+        raise ValueError('unknown fields: ' + ', '.join(sorted(unknown)))
+    r = {'width': None, 'blocked': [], 'algorithm': 'HC', 'steps': 1000, 'seconds': None,
+         'max_evals': None, 'seed': 0}
+    r.update(request)
+
+    if not _is_int(r.get('N')) or r['N'] < 1:
+        raise ValueError('N must be a positive integer')
+    if r['width'] is not None and (not _is_int(r['width']) or r['width'] < 1):
+        raise ValueError('width must be a positive integer')
+    width = r['N'] if r['width'] is None else r['width']
+    if r['N'] * width > MAX_CELLS:
+        raise ValueError('the grid can have at most %d cells' % MAX_CELLS)
+    if not isinstance(r['blocked'], list) or len(r['blocked']) > r['N'] * width:
+        raise ValueError('blocked must be a list of [row, col] cells')
+    for cell in r['blocked']:
+        if (not isinstance(cell, list) or len(cell) != 2
+                or not all(_is_int(i) for i in cell)
+                or not (0 <= cell[0] < r['N'] and 0 <= cell[1] < width)):
+            raise ValueError('blocked cell %s is not a [row, col] on the grid' % (cell,))
+    blocks = r.get('blocks')
+    if not isinstance(blocks, dict):
+        raise ValueError('blocks must map block names to counts')
+    for b, count in blocks.items():
+        if b not in P.LIBRARY:
+            raise ValueError('unknown block: ' + str(b))
+        if not _is_int(count) or count < 0:
+            raise ValueError('the count of %s must be a non-negative integer' % b)
+    if r['algorithm'] not in solver.ALGORITHMS:
+        raise ValueError('algorithm must be one of ' + ', '.join(solver.ALGORITHMS))
+    if not _is_int(r['steps']) or r['steps'] < 0:
+        raise ValueError('steps must be a non-negative integer')
+    if r['seconds'] is not None and (isinstance(r['seconds'], bool)
+                                     or not isinstance(r['seconds'], (int, float))
+                                     or not r['seconds'] > 0):
+        raise ValueError('seconds must be a positive number')
+    if r['max_evals'] is not None and (not _is_int(r['max_evals']) or r['max_evals'] < 0):
+        raise ValueError('max_evals must be a non-negative integer')
+    if not _is_int(r['seed']):
+        raise ValueError('seed must be an integer')
+    return r
+
+
+class SolveService(object):
+    """Runs solve requests on a process pool, sharing and caching results.
+    """
+
+    def __init__(self, workers=None, cache_size=1024):
+        """
+        :param workers: number of worker processes (default: one per CPU)
+        :param cache_size: the most finished results to keep
+        """
+        self.flags = multiprocessing.Array('b', MAX_IN_FLIGHT, lock=False)
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                           initializer=_init_worker,
+                                                           initargs=(self.flags,))
+        self.free_slots = list(range(MAX_IN_FLIGHT))
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+
+        # key -> [future, slot, number of requests waiting on it]
+        self.running = {}
+
+        self.stats = {'requests': 0, 'searches': 0, 'coalesced': 0, 'cached': 0,
+                      'cancelled': 0}
+
+    def key(self, request):
+        """ What identifies a request: the instance fingerprint and the
+        search settings.
+        """
+        theProblem = make_problem(request)
+        return (theProblem.fingerprint(), request['algorithm'], request['steps'],
+                request['seconds'], request['max_evals'], request['seed'])
+
+    async def submit(self, request):
+        """ Solve a request, given as a dictionary (see validate()).
+            :return: the result dictionary
+            :raise ValueError: if the request is not valid
+        """
+        request = validate(request)
+        key = self.key(request)
+        self.stats['requests'] += 1
+
+        if key in self.cache:
+            self.stats['cached'] += 1
+            self.cache.move_to_end(key)
+            return dict(self.cache[key], cached=True)
+
+        job = self.running.get(key)
+        if job is None:
+            if not self.free_slots:
+                raise RuntimeError('too many searches in flight')
+            slot = self.free_slots.pop()
+            self.flags[slot] = 0
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.pool, run_search, request, slot)
+            job = self.running[key] = [future, slot, 0]
+            future.add_done_callback(lambda f: self.finished(key, f))
+            self.stats['searches'] += 1
+        else:
+            self.stats['coalesced'] += 1
+
+        job[2] += 1
+        try:
+            # shielded, so one waiter giving up doesn't cancel the others
+            result = await asyncio.shield(job[0])
+        except asyncio.CancelledError:
+            job[2] -= 1
+            if job[2] == 0:
+                self.cancel_job(key)
+            raise
+        job[2] -= 1
+        return dict(result, cached=False)
+
+    async def solve(self, N, blocks, algorithm='HC', steps=1000, seconds=None,
+                    max_evals=None, seed=0):
+        """ Solve one instance.
+            :param N: the grid size
+            :param blocks: dictionary of block counts
+            :param algorithm: one of solver.ALGORITHMS
+            :param steps: the step budget
+            :param seconds: time limit for the search, or None
+            :param max_evals: evaluation limit for the search, or None
+            :param seed: seed for the search
+            :return: the result dictionary
+        """
+        return await self.submit({'N': N, 'blocks': blocks, 'algorithm': algorithm,
+                                  'steps': steps, 'seconds': seconds,
+                                  'max_evals': max_evals, 'seed': seed})
+
+    def finished(self, key, future):
+        # a search is done: free its slot, and keep the result if it ran
+        # to the end
+        job = self.running.pop(key)
+        self.free_slots.append(job[1])
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        if result['cancelled']:
+            self.stats['cancelled'] += 1
+        elif self.cache_size > 0:
+            self.cache[key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def cancel_job(self, key):
+        job = self.running.get(key)
+        if job is not None:
+            # the worker stops at its next step (or its first, if it hasn't
+            # started yet); the slot stays taken until it has
+            self.flags[job[1]] = 1
+
+    def cancel(self, request):
+        """ Cancel the running search for a request, if there is one.  Its
+            waiters get back the best state it found.
+            :return: True if there was one to cancel
+        """
+        key = self.key(validate(request))
+        if key not in self.running:
+            return False
+        self.cancel_job(key)
+        return True
+
+    def close(self):
+        """ Cancel everything, and shut the worker processes down.
+        """
+        for key in list(self.running):
+            self.cancel_job(key)
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+async def handle(service, reader, writer):
+    """ Answer one HTTP request.
+    """
+    status, answer = 200, None
+    try:
+        method, path, version = (await reader.readline()).decode('latin-1').split()
+        length = 0
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, value = line.split(':', 1)
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        body = await reader.readexactly(length) if length else b''
+
+        if method == 'GET' and path == '/stats':
+            answer = dict(service.stats, running=len(service.running),
+                          cached_results=len(service.cache))
+        elif method == 'POST' and path == '/solve':
+            answer = await service.submit(json.loads(body))
+        elif method == 'POST' and path == '/cancel':
+            answer = {'cancelled': service.cancel(json.loads(body))}
+        else:
+            status, answer = 404, {'error': 'no such request: %s %s' % (method, path)}
+    except (ValueError, KeyError, asyncio.IncompleteReadError) as e:
+        status, answer = 400, {'error': str(e)}
+    except RuntimeError as e:
+        status, answer = 503, {'error': str(e)}
+    except Exception as e:
+        status, answer = 500, {'error': '%s: %s' % (type(e).__name__, e)}
+
+    data = json.dumps(answer).encode('utf-8')
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error',
+              503: 'Service Unavailable'}
+    writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n'
+                  'Content-Length: %d\r\nConnection: close\r\n\r\n'
+                  % (status, reason[status], len(data))).encode('latin-1') + data)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=8317, unix=None):
+    """ Run the HTTP server until cancelled.
+        :param unix: path of a Unix socket to listen on instead of a port
+    """
+    def connected(reader, writer):
+        return handle(service, reader, writer)
+    if unix is not None:
+        server = await asyncio.start_unix_server(connected, path=unix)
+    else:
+        server = await asyncio.start_server(connected, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=argv[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8317)
+    parser.add_argument('--unix', metavar='PATH', default=None,
+                        help='listen on this Unix socket instead of a port')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='the most results to remember')
+    args = parser.parse_args(argv[1:])
+
+    service = SolveService(args.workers, args.cache_size)
+    print('Listening on', args.unix or '%s:%d' % (args.host, args.port))
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,154 @@
+# CMPT 317: A persistent cache of the best solutions found, per instance
+
+# The same instances get solved over and over.  A SolutionCache remembers, in a
+# SQLite file, the best State found so far for each instance, keyed by
+# Problem.fingerprint() (grid size, blocks, starting placements and shapes, in
+# any order).  Along with it are kept:
+#  - the best lower bound known for the score (0, or what exact.solve() proved),
+#    so a result is known to be optimal when its score reaches the bound;
+#  - the compute spent on the instance over every run: runs, evaluations and
+#    seconds.
+#
+# Recording a result never makes the cache worse: the stored State is only
+# replaced by a better one, and the bound only goes up.  Each record() is one
+# transaction, so several processes can share a cache file.
+#
+# solver.py --cache FILE hands back a cached optimal result straight away, and
+# otherwise starts the search from the cached State (see
+# localsearch.initial_state()).
+#
+# Usage:
+#   import solutions
+#   with solutions.SolutionCache('tiles.db') as cache:
+#       entry = cache.lookup(theProblem)
+#       if entry is None or not entry.optimal:
+#           ... search ...
+#           cache.record(theProblem, solution, evals, seconds)
+
+import json
+import sqlite3
+import time
+
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS solutions (
+    fingerprint TEXT PRIMARY KEY,
+    score INTEGER NOT NULL,
+    lower_bound INTEGER NOT NULL,
+    state BLOB NOT NULL,
+    placements TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    evals INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    updated REAL NOT NULL
+)
+'''
+
+
+class Entry(object):
+    """What the cache knows about one instance.
+    """
+
+    def __init__(self, state, score, lower_bound, runs, evals, seconds):
+        """
+        :param state: the best State found
+        :param score: its score
+        :param lower_bound: no State scores less than this
+        :param runs: the number of results recorded
+        :param evals: the evaluations spent, over every run
+        :param seconds: the time spent, over every run
+        """
+        self.state = state
+        self.score = score
+        self.lower_bound = lower_bound
+        self.optimal = score <= lower_bound
+        self.runs = runs
+        self.evals = evals
+        self.seconds = seconds
+
+    def __str__(self):
+        if self.optimal:
+            found = "optimal score %d" % self.score
+        else:
+            found = "best score %d, lower bound %d" % (self.score, self.lower_bound)
+        return "Cached: %s (%d runs, %d evals, %.3f secs)" % (found, self.runs, self.evals,
+                                                             self.seconds)
+
+
+class SolutionCache(object):
+    """The best solution found for each instance, kept in a SQLite file.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        """
+        :param path: the database file; it is made if it isn't there
+        :param timeout: seconds to wait for another process's transaction
+        """
+        self.path = path
+        # transactions are begun by hand, so that reading a row and
+        # writing it back happen under one lock
+        self.db = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.db.execute(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM solutions').fetchone()[0]
+
+    def lookup(self, problem):
+        """ What is cached for a problem.
+            :param problem: a blockTiling.Problem
+            :return: an Entry, or None if the instance hasn't been seen
+        """
+        row = self.db.execute('SELECT state, score, lower_bound, runs, evals, seconds '
+                              'FROM solutions WHERE fingerprint = ?',
+                              (problem.fingerprint(),)).fetchone()
+        if row is None:
+            return None
+        state = problem.state_from_bytes(row[0])
+        return Entry(state, *row[1:])
+
+    def record(self, problem, state, evals=0, seconds=0.0, lower_bound=0):
+        """ Remember the result of a run.
+            :param problem: a blockTiling.Problem
+            :param state: the best State the run found
+            :param evals: the evaluations the run spent
+            :param seconds: the time the run took
+            :param lower_bound: a lower bound on the score, if the run found
+                                one (e.g. exact.Result.lower_bound)
+            :return: True if state is better than what was cached
+        """
+        key = problem.fingerprint()
+        score = state.get_score()
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.db.execute('SELECT score, lower_bound FROM solutions WHERE fingerprint = ?',
+                                  (key,)).fetchone()
+            if row is None:
+                self.db.execute('INSERT INTO solutions VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?)',
+                                (key, score, lower_bound, state.to_bytes(),
+                                 json.dumps(state.used), evals, seconds, now))
+                better = True
+            else:
+                better = score < row[0]
+                if better:
+                    self.db.execute('UPDATE solutions SET score = ?, state = ?, placements = ? '
+                                    'WHERE fingerprint = ?',
+                                    (score, state.to_bytes(), json.dumps(state.used), key))
+                self.db.execute('UPDATE solutions SET lower_bound = ?, runs = runs + 1, '
+                                'evals = evals + ?, seconds = seconds + ?, updated = ? '
+                                'WHERE fingerprint = ?',
+                                (max(row[1], lower_bound), evals, seconds, now, key))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return better
@@ -1,66 +1,354 @@
 # CMPT 317: Simple solver for testing purposes with local search
 
 
+import argparse
+import concurrent.futures
+import csv
+import json
 import math
+import os
 import sys
 import time
 import blockTiling as P
 import localsearch as search
+import evolution
+import exact
+import instances
+import instrument
+import lns
+import solutions
 
 
-# process the command line
-if len(sys.argv) != 4:
-    print('Usage: python', sys.argv[0], '<filename> <RG,RS,HC,HCLR,HCFR> <num_steps>')
-    sys.exit()
+ALGORITHMS = ['RG', 'RS', 'HC', 'HCFI', 'HCLR', 'HCFR', 'SA', 'TS', 'GA', 'LNS', 'EX']
 
+# What a batch run tries by default: everything but the exact search, which
+# takes its whole time limit on any grid worth sweeping
+BATCH_ALGORITHMS = [a for a in ALGORITHMS if a != 'EX']
 
-file = open(sys.argv[1], 'r')
-line = file.readline()
-blocks = {}
-N = int(line)
-line = file.readline()
+# Seconds the exact search may take when the budget doesn't say
+EX_DEADLINE = 10.0
 
-while line:
-    line = line.rstrip().split()
-    blocks[line[0]] = int(line[1])
-    line = file.readline()
 
-    
-file.close()
+def read_problem(filename, cache_size=0, orientations=False, symmetry=False, instance=0):
+    """ Read a problem file: the grid size on the first line, then
+        one 'name count' line for each kind of block (see instances.py
+        for files with more than one instance, and the binary format).
+        :param filename: path to the file
+        :param cache_size: size of the Problem's transposition table
+        :param orientations: allow rotated and reflected blocks
+        :param symmetry: treat mirror-image States as the same
+        :param instance: which instance in the file to read, from 0
+        :return: a Problem
+    """
+    problems = instances.read_file(filename, cache_size=cache_size,
+                                   orientations=orientations, symmetry=symmetry)
+    for k, theProblem in enumerate(problems):
+        if k == instance:
+            problems.close()
+            return theProblem
+    raise ValueError('%s has no instance %d' % (filename, instance))
 
-algorithm = sys.argv[2]    
-steps = int(sys.argv[3])
 
-theProblem = P.Problem(N, blocks)
+# How a search can make its starting state (see localsearch.initial_state())
+INITS = ['random', 'bottom-left', 'constrained']
 
-print()
-print("----")
-print("Running", sys.argv)
-print("----")
 
-if algorithm == 'RG':
-    start = time.perf_counter()
-    solution = search.random_guessing(theProblem, steps)
-    end = time.perf_counter()
-elif algorithm == 'RS':
-    start = time.perf_counter()
-    solution = search.random_search(theProblem, steps)
-    end = time.perf_counter()
-elif algorithm == 'HC':
+def solve(theProblem, algorithm, steps, workers=1, seed=None, budget=None, checkpoint=None,
+          init=None):
+    """ Run one of the search algorithms on a problem.
+        :param theProblem: a Problem
+        :param algorithm: one of ALGORITHMS
+        :param steps: the step budget
+        :param workers: number of processes for the restart algorithms
+        :param seed: seed for the problem's random numbers, or None
+        :param budget: an optional localsearch.Budget
+        :param checkpoint: an optional localsearch.Checkpoint, for the
+                           restart algorithms
+        :param init: one of INITS, how to make the starting state, or a State
+                     to start from; for EX, the greedy state or the State is
+                     the incumbent to beat
+        :return: the solution State
+    """
+    if seed is not None:
+        theProblem.seed(seed)
+
+    if algorithm == 'RG':
+        return search.random_guessing(theProblem, steps, budget, init)
+    elif algorithm == 'RS':
+        return search.random_search(theProblem, steps, budget, init)
+    elif algorithm == 'HC':
+        return search.hillclimbing(theProblem, steps, budget, init)
+    elif algorithm == 'HCFI':
+        # hill climbing, taking the (F)irst (I)mprovement found
+        return search.first_improvement_hillclimbing(theProblem, steps, budget, init)
+    elif algorithm in ('HCLR', 'HCFR'):
+        # hill climbing with "(L)ong (R)estarts" or "(F)requent (R)estarts"
+        limit = 100 if algorithm == 'HCLR' else 20
+        if workers > 1:
+            return search.parallel_random_restart(theProblem, steps // limit, limit,
+                                                  workers=workers, seed=seed, budget=budget,
+                                                  checkpoint=checkpoint, init=init)
+        return search.random_restart(theProblem, steps // limit, limit, budget=budget,
+                                     checkpoint=checkpoint, init=init)
+    elif algorithm == 'SA':
+        # simulated annealing, cooled evenly over the whole budget
+        schedule = search.linear_cooling(2.0, steps)
+        return search.simulated_annealing(theProblem, steps, schedule, budget, init)
+    elif algorithm == 'TS':
+        return search.tabu_search(theProblem, steps, budget=budget, init=init)
+    elif algorithm == 'GA':
+        # genetic algorithm, with an island per worker; the steps are
+        # spread over the generations of all the islands
+        population = 20
+        islands = max(1, workers)
+        generations = max(1, steps // (population * islands))
+        return evolution.genetic_algorithm(theProblem, generations, population, islands,
+                                           workers, seed=seed, budget=budget, init=init)
+    elif algorithm == 'LNS':
+        # large neighbourhood search, repairing a 4x4 window per worker
+        # each step
+        return lns.large_neighbourhood_search(theProblem, steps, 4, max(1, workers), workers,
+                                              budget=budget, init=init)
+    elif algorithm == 'EX':
+        # exact search; the steps don't matter, only the deadline, which
+        # is never left open (it may well not finish)
+        deadline = EX_DEADLINE
+        if budget is not None and budget.end is not None:
+            deadline = max(0.0, budget.end - time.perf_counter())
+        incumbent = None
+        if isinstance(init, P.State):
+            incumbent = init
+        elif init not in (None, 'random'):
+            incumbent = theProblem.greedy_state(init)
+        result = exact.solve(theProblem, deadline, incumbent)
+        if result.state is None:
+            return incumbent or theProblem.create_initial_state()
+        return result.state
+    raise ValueError('unknown algorithm: ' + algorithm)
+
+
+def run_job(job):
+    """ Run one batch job, (index, label, problem, algorithm, steps, seed),
+        and return its result as a dictionary.
+    """
+    index, filename, theProblem, algorithm, steps, seed = job
     start = time.perf_counter()
-    solution = search.hillclimbing(theProblem, steps)
+    solution = solve(theProblem, algorithm, steps, seed=seed)
     end = time.perf_counter()
-elif algorithm == 'HCLR':
-    # hill climbing with "(L)ong (R)estarts"
+    return {'job': index, 'file': filename, 'algorithm': algorithm, 'steps': steps,
+            'seed': seed, 'score': solution.get_score(), 'time': end - start,
+            'placements': solution.used}
+
+
+def batch_jobs(filenames, algorithms, step_counts, seed=0):
+    """ The jobs of a batch run, one instance at a time, as they are read.
+        :return: a generator of (index, label, problem, algorithm, steps, seed)
+    """
+    index = 0
+    for label, theProblem in instances.load(filenames):
+        for a in algorithms:
+            for steps in step_counts:
+                yield (index, label, theProblem, a, steps, seed + index)
+                index += 1
+
+
+def run_batch(filenames, algorithms, step_counts, out, workers=1, seed=0):
+    """ Run every algorithm, for every step count, on every instance in
+        the files, and write one result per line to out, as it finishes.
+        Instances are read as they are needed, so there is no limit on how
+        many the files hold.
+        :param filenames: list of problem files or directories of them
+        :param algorithms: list of codes from ALGORITHMS
+        :param step_counts: list of step budgets
+        :param out: output path; CSV if it ends in .csv, otherwise JSON lines
+        :param workers: number of worker processes
+        :param seed: job i is seeded with seed+i
+    """
+    jobs = batch_jobs(filenames, algorithms, step_counts, seed)
+
+    fields = ['job', 'file', 'algorithm', 'steps', 'seed', 'score', 'time', 'placements']
+    with open(out, 'w', newline='') as file:
+        if out.endswith('.csv'):
+            writer = csv.DictWriter(file, fields)
+            writer.writeheader()
+            def write(result):
+                result['placements'] = json.dumps(result['placements'])
+                writer.writerow(result)
+        else:
+            def write(result):
+                file.write(json.dumps(result) + '\n')
+
+        if workers <= 1:
+            for job in jobs:
+                write(run_job(job))
+            return
+
+        # keep a few jobs per worker queued, rather than reading every
+        # instance up front
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            running = set()
+            for job in jobs:
+                running.add(pool.submit(run_job, job))
+                if len(running) >= 2 * workers:
+                    done, running = concurrent.futures.wait(
+                        running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for f in done:
+                        write(f.result())
+                    file.flush()
+            for f in concurrent.futures.as_completed(running):
+                write(f.result())
+                file.flush()
+
+
+def batch_main(argv):
+    # process the command line for a batch run
+    parser = argparse.ArgumentParser(prog=argv[0] + ' --batch')
+    parser.add_argument('filenames', nargs='+',
+                        help='problem files, or directories of them')
+    parser.add_argument('--algorithms', nargs='+', choices=ALGORITHMS, default=BATCH_ALGORITHMS,
+                        help='the algorithms to run (default: all but EX)')
+    parser.add_argument('--steps', nargs='+', type=int, default=[200, 1000, 5000])
+    parser.add_argument('--out', default='results.jsonl',
+                        help='results file; .csv for CSV, otherwise JSON lines')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='job i is seeded with seed+i')
+    args = parser.parse_args(argv[2:])
+
     start = time.perf_counter()
-    solution = search.random_restart(theProblem, steps // 100, 100)
+    run_batch(args.filenames, args.algorithms, args.steps, args.out, args.workers, args.seed)
     end = time.perf_counter()
-elif algorithm == 'HCFR':
-    # hill climbing with "(F)requent (R)estarts"
+    print("Results written to", args.out)
+    print("Time used:", (end-start), "secs")
+
+
+def main(argv):
+    # process the command line
+    parser = argparse.ArgumentParser(prog=argv[0])
+    parser.add_argument('filename')
+    parser.add_argument('algorithm', choices=ALGORITHMS)
+    parser.add_argument('num_steps', type=int)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes to spread HCLR/HCFR restarts, GA islands '
+                             'or LNS repairs over')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed, for reproducible runs')
+    parser.add_argument('--time', type=float, default=None,
+                        help='stop after this many seconds with the best so far')
+    parser.add_argument('--max-evals', type=int, default=None,
+                        help='stop after this many evaluations with the best so far')
+    parser.add_argument('--tt-size', type=int, default=0,
+                        help='remember the moves of this many states')
+    parser.add_argument('--bound', type=float, default=None, metavar='SECONDS',
+                        help='afterwards, spend this long on a lower bound for the score')
+    parser.add_argument('--orientations', action='store_true',
+                        help='let blocks be rotated and reflected')
+    parser.add_argument('--symmetry', action='store_true',
+                        help='treat rotations and reflections of a state as the same '
+                             '(implies --orientations)')
+    parser.add_argument('--instance', type=int, default=0,
+                        help='which instance to solve, in a file with several (from 0)')
+    parser.add_argument('--profile', metavar='FILE', default=None,
+                        help='count and time the calls made, and save them to FILE: '
+                             'JSON if it ends in .json, otherwise folded stacks for a flame graph')
+    parser.add_argument('--init', choices=INITS, default='random',
+                        help='how the search makes its starting state (default random)')
+    parser.add_argument('--cache', metavar='FILE', default=None,
+                        help='keep the best solution of each instance in this SQLite file: '
+                             'a cached optimal one is returned at once, otherwise the '
+                             'search starts from the cached one')
+    parser.add_argument('--checkpoint', metavar='FILE', default=None,
+                        help='save the progress of HCLR/HCFR to FILE as it goes')
+    parser.add_argument('--checkpoint-every', type=float, default=60.0, metavar='SECONDS',
+                        help='the least time between checkpoints (default 60)')
+    parser.add_argument('--resume', action='store_true',
+                        help='carry on from the progress saved in the --checkpoint file')
+    args = parser.parse_args(argv[1:])
+
+    if args.checkpoint is not None and args.algorithm not in ('HCLR', 'HCFR'):
+        parser.error('--checkpoint only works with HCLR and HCFR')
+    if args.resume and args.checkpoint is None:
+        parser.error('--resume needs --checkpoint')
+    if args.checkpoint is not None and not args.resume and os.path.exists(args.checkpoint):
+        parser.error(args.checkpoint + ' already exists; use --resume to carry on from it')
+
+    theProblem = read_problem(args.filename, args.tt_size, args.orientations, args.symmetry,
+                              args.instance)
+
+    checkpoint = None
+    if args.checkpoint is not None:
+        key = (theProblem.fingerprint(), args.algorithm, args.num_steps, args.workers > 1,
+               args.init)
+        checkpoint = search.Checkpoint(args.checkpoint, args.checkpoint_every, key)
+
+    print()
+    print("----")
+    print("Running", argv)
+    print("----")
+
+    cache = None
+    cached = None
+    init = args.init
+    if args.cache is not None:
+        cache = solutions.SolutionCache(args.cache)
+        cached = cache.lookup(theProblem)
+        if cached is not None:
+            print(cached)
+            if cached.optimal:
+                print(cached.state)
+                cache.close()
+                return
+            init = cached.state
+
+    budget = search.Budget(args.time, args.max_evals)
+    if args.profile:
+        profiler = instrument.Profiler()
+        profiler.enable()
+        profiler.watch(budget)
     start = time.perf_counter()
-    solution = search.random_restart(theProblem, steps // 20, 20)
+    solution = solve(theProblem, args.algorithm, args.num_steps, args.workers, args.seed,
+                     budget, checkpoint, init)
     end = time.perf_counter()
-    
-print(solution)
-print("Time used:", (end-start), "secs")
+    if args.profile:
+        profiler.disable()
+    if cached is not None and cached.state.is_better_than(solution):
+        # the search didn't start from the cached state after all (e.g. a
+        # resumed checkpoint was already past its first restart)
+        solution = cached.state
+
+    print(solution)
+    print("Time used:", (end-start), "secs")
+
+    if args.profile:
+        print()
+        profiler.report()
+        profiler.save(args.profile)
+        print("Profile written to", args.profile)
+
+    if args.bound is not None:
+        # how far could the solution be from optimal?
+        result = exact.solve(theProblem, args.bound, solution)
+        print(result)
+        if result.optimal:
+            print("Optimality gap:", result.gap(solution.get_score()))
+        else:
+            # an unfinished search only has a weak lower bound
+            print("Optimality gap: at most", result.gap(solution.get_score()))
+        if result.state is not None:
+            solution = result.state
+        lower_bound = result.lower_bound
+    else:
+        lower_bound = 0
+
+    if cache is not None:
+        if cache.record(theProblem, solution, budget.evals, end - start, lower_bound):
+            print("New best solution cached in", args.cache)
+        cache.close()
+
 
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--batch':
+        batch_main(sys.argv)
+    else:
+        main(sys.argv)